@@ -16,9 +16,12 @@
 import sys
 import os
 import logging
+import threading
 
 from opscli import console
 from opscli import linehelper
+from opscli import manifest
+from opscli import pipe
 from opscli.command import context
 
 
@@ -31,6 +34,9 @@ ExitMarker = object()
 # Used to travel backwards to the previous context
 ExitContextMarker = object()
 
+# Lines starting with these are skipped in batch mode.
+COMMENTS = '!#'
+
 
 class OpsContext(context.Context):
     # TODO(bluecmd): Remove
@@ -39,68 +45,111 @@ class OpsContext(context.Context):
         self.ovsdb = ovsdb
 
 
-class Opscli(object):
-    '''
-    This class extends pyrepl's Reader to provide command modules.
-    '''
-    def __init__(self, ovsdb, module_paths=None, motd='OpenSwitch shell'):
-        # Initialize the OVSDB helper.
-        prompt_base = 'Openswitch'
+# OVSDB columns the shell itself reads.
+OVSDB_TABLES = {
+    'System': ['mgmt_intf_status'],
+}
 
-        # TODO shell hangs before prompt if this is down
-        try:
-            results = ovsdb.get_map('System', column='mgmt_intf_status')
-            if 'hostname' in results:
-                prompt_base = results['hostname']
-        except:
-            logging.exception('Failed to get hostname from OVSDB')
 
-        # Initialize command tree.
-        self.root = context.ContextTree(OpsContext)
-        self.global_root = context.ContextTree(OpsContext)
+def error_message(error, line):
+    """Returns the message to show for an error raised by line."""
+    if isinstance(error, linehelper.CommandNotFoundError):
+        return 'Command not found: %s' % line
+    if isinstance(error, linehelper.Error):
+        return 'Invalid input: %s' % error.args[0]
+    return 'Command failed: %s: %s' % (line, error)
 
-        for path in module_paths:
-            if not os.path.isdir(path):
-                logging.warn('Ignoring invalid module path "%s".', path)
-                continue
-            self.load_commands(path)
 
-        self.context = self.root(ovsdb)
-        self.global_context = self.global_root(ovsdb)
-        self.context_stack = []
+class Session(object):
+    """A user of the shell, with their own place in the context tree.
+
+    Sessions made by the same Opscli share its command trees, see
+    Opscli.new_session().
+    """
 
+    def __init__(self, context, global_context, trees=None):
+        self.context = context
+        self.context_stack = []
         # This is the object that advises the console of what commands are
         # possible.
         self.linehelper = linehelper.ContextLineHelper(
-                self.context, self.global_context)
+                context, global_context, trees)
 
-        self.console = console.PyreplConsole(prompt_base, motd, self.linehelper)
+    def run_batch(self, lines, stream=sys.stdout, errors=sys.stderr):
+        """Run lines one after the other, without a console.
 
-    def load_commands(self, path):
-        sys.path.insert(0, path)
-        for filename in os.listdir(path):
-            if not filename.endswith('.py') or filename.endswith('_test.py'):
-                continue
-            module = __import__(filename[:-3])
-            if hasattr(module, 'register'):
-                module.register(self.root, self.global_root)
+        Blank lines and comments are skipped. Output is written to stream.
+        A line that fails, or whose command fails while producing its
+        output, is reported with its number on errors, and the lines after
+        it are still run.
 
-    def start(self):
-        for line in self.console.loop():
-            ret = self.process_line(line)
-            if ret is None:
+        Returns the exit code: 0 if every line ran, 1 otherwise.
+        """
+        status = 0
+        for number, line in enumerate(lines, 1):
+            line = line.strip()
+            if not line or line[0] in COMMENTS:
                 continue
-            elif ret == ExitMarker:
-                break
-            self.console.output(ret)
-            # TODO catch all exceptions, log traceback, print error msg
+            try:
+                ret = self.process(
+                    self.linehelper.resolve_commands(line), strict=True)
+                if ret == ExitMarker:
+                    break
+                self.write_output(ret, stream)
+            except Exception as e:
+                stream.flush()
+                errors.write('%% line %d: %s\n' % (
+                    number, error_message(e, line)))
+                status = 1
+        stream.flush()
+        return status
+
+    def write_output(self, output, stream):
+        if output is None:
+            return
+        if isinstance(output, basestring):
+            output = (output, )
+        for text in output:
+            if text:
+                stream.write(text)
+                if text[-1] != '\n':
+                    stream.write('\n')
+
+    def reset(self):
+        """Go back to the root of the context tree."""
+        if self.context_stack:
+            self.context = self.context_stack[0]
+            del self.context_stack[:]
+            self.linehelper.set_context(self.context)
 
     def process_line(self, line):
-        # TODO(bluecmd): When we implement pipe support this needs to change
-        command, options = next(self.linehelper.resolve_commands(line))
+        """Run the commands in a line.
+
+        Output can be a generator, which runs the command as it is
+        consumed. Output piped to filters is returned as a generator of
+        lines, which runs the filters as it is consumed.
+        """
+        return self.process(self.linehelper.resolve_commands(line))
+
+    def process_words(self, commands):
+        """Like process_line(), for a line already split into commands of
+        words."""
+        return self.process(self.linehelper.resolve_words(commands))
+
+    def process(self, commands, strict=False):
+        """Run resolved commands, see linehelper.resolve_commands().
+
+        A command that can't be called with its options is logged and
+        gives no output, or raises TypeError if strict.
+        """
+        command, options = next(commands)
+        # Find all filters before running anything
+        filters = list(commands)
         try:
             ret = command(*options)
         except TypeError as e:
+            if strict:
+                raise
             logging.exception(
                     'Tried calling %s but got "%s"', command, str(e))
             # TODO(bluecmd): Raise exception?
@@ -113,10 +162,132 @@ class Opscli(object):
                 self.context = self.context_stack.pop()
                 self.linehelper.set_context(self.context)
             return
-        # Did we switch context to a new one?
-        elif self.context != ret.context:
+        # Did we switch context to a new one? Commands are bound to their
+        # place in the context tree, and return it when they don't switch.
+        elif ret.context is not command.command.context:
             self.context_stack.append(self.context)
             logging.info('Switching context to %s', context)
             self.context = ret.context
             self.linehelper.set_context(self.context)
+        if filters and ret.value != ExitMarker:
+            return pipe.run(ret.value, filters)
         return ret.value
+
+
+class Opscli(object):
+    '''
+    This class extends pyrepl's Reader to provide command modules.
+    '''
+    def __init__(self, ovsdb, module_paths=None, motd='OpenSwitch shell',
+                 replicate=False, interactive=True):
+        # Initialize the OVSDB helper.
+        self.ovsdb = ovsdb
+        # Shown until the hostname has been fetched from OVSDB.
+        self.prompt_base = 'Openswitch'
+        self.motd = motd
+
+        # Initialize command tree.
+        self.root = context.ContextTree(OpsContext)
+        self.global_root = context.ContextTree(OpsContext)
+        # OVSDB tables and columns used by the loaded command modules.
+        self.tables = dict(OVSDB_TABLES)
+
+        self.session = None
+        manifests = []
+        for path in module_paths:
+            if not os.path.isdir(path):
+                logging.warn('Ignoring invalid module path "%s".', path)
+                continue
+            manifests.append((path, self.load_commands(path)))
+
+        # Match trees are saved with the first module directory's manifest.
+        self.trees = None
+        if manifests:
+            trees_path = manifests[0][0]
+            trees_key = manifest.trees_key(manifests)
+            self.trees = manifest.read_trees(trees_path, trees_key)
+
+        self.session = self.new_session()
+        self.linehelper = self.session.linehelper
+        if manifests and self.trees is None:
+            self.trees = self.linehelper.compile(self.root)
+            manifest.write_trees(trees_path, trees_key, self.trees)
+
+        if not interactive:
+            # Lines are run with run_batch(), without a terminal.
+            self.console = None
+            if replicate:
+                self.ovsdb.replicate(self.tables)
+            return
+
+        self.console = console.PyreplConsole(
+                self.prompt_base, motd, self.linehelper)
+
+        # Talking to OVSDB can take a while, or hang if it is down, so it
+        # mustn't hold up the prompt.
+        startup = threading.Thread(target=self.connect_ovsdb,
+                                   args=(replicate,))
+        startup.daemon = True
+        startup.start()
+
+    def connect_ovsdb(self, replicate):
+        """Runs in the background at startup."""
+        try:
+            if replicate:
+                self.ovsdb.replicate(self.tables)
+            results = self.ovsdb.get_map('System', column='mgmt_intf_status')
+        except:
+            logging.exception('Failed to get hostname from OVSDB')
+            return
+        if 'hostname' in results:
+            self.prompt_base = results['hostname']
+            if self.console is not None:
+                self.console.set_prompt_base(self.prompt_base)
+
+    def load_commands(self, path):
+        sys.path.insert(0, path)
+        # Modules are only imported when needed, see manifest.py.
+        loaded = manifest.load_commands(path, self.root, self.global_root)
+        for record in loaded['modules']:
+            if record['tables'] is not None:
+                self.add_tables(record['tables'])
+        if self.session is not None:
+            self.linehelper.invalidate()
+            # Trees for new sessions
+            self.trees = self.linehelper.compile(self.root)
+        return loaded
+
+    def add_tables(self, tables):
+        """Merge the OVSDB columns a module reads into self.tables."""
+        for table, columns in tables.iteritems():
+            if table not in self.tables:
+                self.tables[table] = columns
+            elif columns is None or self.tables[table] is None:
+                self.tables[table] = None
+            else:
+                merged = list(self.tables[table])
+                for column in columns:
+                    if column not in merged:
+                        merged.append(column)
+                self.tables[table] = merged
+
+    def new_session(self):
+        """Returns a session starting at the root of the context tree."""
+        return Session(self.root(self.ovsdb), self.global_root(self.ovsdb),
+                       self.trees)
+
+    def run_batch(self, *args, **kwargs):
+        return self.session.run_batch(*args, **kwargs)
+
+    def process_line(self, line):
+        return self.session.process_line(line)
+
+    def start(self):
+        for line in self.console.loop():
+            ret = self.process_line(line)
+            if ret is None:
+                continue
+            elif ret == ExitMarker:
+                break
+            self.console.write(ret)
+            # TODO catch all exceptions, log traceback, print error msg
@@ -0,0 +1,71 @@
+import StringIO
+
+from opscli import cli
+from opscli import testing
+from opscli.command import command
+
+
+class Exit(command.Utility):
+    def command(self):
+        return cli.ExitContextMarker
+
+
+class Fail(command.Utility):
+    def command(self):
+        raise RuntimeError('no database')
+
+
+class Broken(command.Utility):
+    def command(self):
+        yield 'first'
+        raise RuntimeError('lost database')
+
+
+class Missing(command.Utility):
+    def command(self, name):
+        return name
+
+
+def register(root, everywhere):
+    testing.register(root, everywhere)
+    everywhere.exit = Exit
+    root.fail = Fail
+    root.broken = Broken
+    root.missing = Missing
+
+
+def run(lines):
+    shell = testing.shell(register)
+    stream = StringIO.StringIO()
+    errors = StringIO.StringIO()
+    status = shell.run_batch(lines, stream, errors)
+    return status, stream.getvalue(), errors.getvalue()
+
+status, output, errors = run([
+    '! comment\n', 'show | include 1\n', '\n', 'vlan\n', 'show\n',
+    'exit\n', 'show | count\n'])
+print status == 0
+print errors == ''
+print output.splitlines() == [
+    'row 1 in (root) >', 'row 0 in (vlan)', 'row 1 in (vlan)',
+    'row 2 in (vlan)', 'Count: 3']
+
+# Failed lines are reported and the lines after them still run
+status, output, errors = run(['bogus', 'show | nothing', 'show "x'])
+print status == 1
+print errors.splitlines() == [
+    '% line 1: Command not found: bogus',
+    '% line 2: Command not found: show | nothing',
+    '% line 3: Command not found: show "x']
+
+# and so are commands that fail, even after some of their output
+status, output, errors = run(['fail', 'broken', 'missing', 'show'])
+print status == 1
+print output.splitlines() == [
+    'first', 'row 0 in (root) >', 'row 1 in (root) >', 'row 2 in (root) >']
+errors = errors.splitlines()
+print errors[:2] == [
+    '% line 1: Command failed: fail: no database',
+    '% line 2: Command failed: broken: lost database']
+print errors[2].startswith('% line 3: Command failed: missing: ')
+print len(errors) == 3
@@ -0,0 +1,138 @@
+"""
+A shell on a session of a server, see server.py.
+
+The client only reads lines and shows output; commands are completed and
+run by the server. Starting one is little more than connecting a socket.
+
+Usage:
+  client = Client('/var/run/ops-cli.sock')
+  client.start()
+"""
+import itertools
+import socket
+
+from opscli import console
+from opscli import linehelper
+from opscli import server
+
+
+# Errors sent by the server, by type
+ERRORS = {
+    'CommandNotFoundError': linehelper.CommandNotFoundError,
+    'CommandParsingError': linehelper.CommandParsingError,
+}
+
+
+class Error(Exception):
+    """Base error class for this module."""
+    pass
+
+
+class ServerError(Error):
+    """The server couldn't answer a request."""
+    pass
+
+
+class RequestError(Error):
+    """The server answered a request with an error, like a command that
+    failed."""
+    pass
+
+
+class RemoteLineHelper(linehelper.LineHelper):
+    """Completes lines with the commands of the session on the server."""
+
+    def __init__(self, client, prompt):
+        self.client = client
+        self.prompt = prompt
+
+    def qhelp(self, line):
+        return self.client.call('qhelp', line=line)
+
+    def complete(self, line):
+        return self.client.call('complete', line=line)
+
+
+class Client(object):
+
+    def __init__(self, path):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(path)
+        self.channel = server.Channel(sock)
+        self.ids = itertools.count(1)
+        # The result of the last line processed
+        self.result = None
+        self.session = self.call('session')
+        self.helper = RemoteLineHelper(self, self.session['prompt'])
+        self.console = None
+
+    def request(self, method, **params):
+        """Send a request and return its id."""
+        request_id = next(self.ids)
+        self.channel.send(
+            {'id': request_id, 'method': method, 'params': params})
+        return request_id
+
+    def response(self, request_id):
+        """Returns the next message for request_id."""
+        while True:
+            message = self.channel.receive()
+            if message is None:
+                raise ServerError('Connection closed')
+            if message.get('id') == request_id:
+                return message
+
+    def raise_error(self, message):
+        error = message['error']
+        raise ERRORS.get(error['type'], RequestError)(error['message'])
+
+    def call(self, method, **params):
+        message = self.response(self.request(method, **params))
+        if 'error' in message:
+            self.raise_error(message)
+        return message['result']
+
+    def process(self, line):
+        """Yields the output of a line as it arrives.
+
+        The result is kept in self.result. Closing the generator early
+        cancels the rest of the output.
+        """
+        self.result = None
+        request_id = self.request('process', line=line)
+        try:
+            message = self.response(request_id)
+            while 'output' in message:
+                yield message['output']
+                message = self.response(request_id)
+        except GeneratorExit:
+            self.request('cancel', id=request_id)
+            message = self.response(request_id)
+            while 'output' in message:
+                message = self.response(request_id)
+            if 'error' not in message:
+                self.result = message['result']
+            return
+        if 'error' in message:
+            self.raise_error(message)
+        self.result = message['result']
+
+    def start(self):
+        self.console = console.PyreplConsole(
+            self.session['prompt_base'], self.session['motd'], self.helper)
+        for line in self.console.loop():
+            try:
+                self.console.write(self.process(line))
+            except (linehelper.Error, RequestError) as e:
+                self.console.output('% ' + e.args[0])
+                continue
+            except ServerError as e:
+                self.console.output('% ' + e.args[0])
+                break
+            if self.result is None:
+                continue
+            if self.result['exit']:
+                break
+            self.helper.prompt = self.result['prompt']
+            if self.result['prompt_base'] != self.console.prompt_base:
+                self.console.set_prompt_base(self.result['prompt_base'])
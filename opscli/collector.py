@@ -0,0 +1,27 @@
+"""
+Control over the garbage collector while many objects are made at once.
+
+The collector goes through the objects that are still alive every few
+thousand allocations. Building large indexes or unpickling saved trees
+makes objects that all stay alive, so those passes find nothing to free
+and only slow it down.
+
+Usage:
+  with collector.paused():
+      trees = cPickle.load(f)
+"""
+import contextlib
+import gc
+
+
+@contextlib.contextmanager
+def paused():
+    """Keeps the collector from running in the block, unless it was
+    already disabled."""
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
@@ -27,6 +27,17 @@ class MyFeature(command.Feature):
     def activate(self):
         print 'Executing FakeCommand'
 
+Commands that produce a lot of output can yield it instead, a line or a
+few lines at a time. The shell then writes it out as it is produced,
+without holding all of it:
+
+class MyTable(command.Utility):
+    '''Prints a long table'''
+
+    def command(self):
+        for row in range(10000):
+            yield 'row %d' % row
+
 Commands also have two optional fields:
 - options
 - prefixes (TODO)
@@ -96,8 +107,9 @@ class Command(context.ContextBoundObject):
             self.argc = self.func.func_code.co_argcount
 
         def __call__(self, *options):
-            # Command functions return either text to print or switches
-            # context. Find out what it wanted to do.
+            # Command functions return either text to print, a generator of
+            # text to print or switches context. Find out what it wanted to
+            # do.
             ret = self.func(*options)
             ctxt = self.command.context
             value = None
@@ -49,3 +49,15 @@ context.shutdown.Call(is_negated=True)
 context.description.Call('Hello', is_negated=False)
 context.description.Call(is_negated=True)
 context.shutdown.Call(is_negated=False)
+
+
+# Commands can yield their output
+class Table(command.Utility):
+    def command(self, rows):
+        for row in range(rows):
+            yield 'row %d' % row
+
+root.table = Table
+output = root().table.Call(3).value
+print next(output) == 'row 0'
+print list(output) == ['row 1', 'row 2']
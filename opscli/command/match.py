@@ -33,12 +33,32 @@ It has 3 fields:
 - secondary (in opscli; 'option')
 - value     (in opscli; carries the bound command)
 
+The secondary part can also be a compiled token.Grammar. Only the primary
+tokens are then added to the tree, and the remaining words are matched by
+walking the grammar. The match groups returned have the matched option
+tokens as secondary, like for a list.
+
 # Matching
 
 Standard matching is that all tokens must match. If prefix
 matching is enabled we only require matching up until the words
 run out.
 
+Words can also be matched one at a time with a Walk, which is what
+match() does:
+
+walk = t.walk(prefix=True).advance('hel')
+list(walk.matches()) => [mg]
+walk = walk.advance('wo')
+
+# Branch index
+Looking up the branches matching a word is the hot path when completing.
+Literal tokens, which make up most of a tree, are kept in a case-folded
+sorted index so the ones starting with a word are found with a binary
+search. Other tokens (like IPv4Type) can match anything and are kept in a
+separate list that is always checked. The index is built when first
+needed and thrown away when the tree changes.
+
 # Usage
 Using LiteralToken from token.py, it's easy to do command
 completition.
@@ -52,7 +72,11 @@ t.match(('hel', 'wo')) => [mg]
 t.match(('hel',)) => []
 t.match(('hel',), prefix=True) => [mg]
 """
+import bisect
 import collections
+import operator
+
+from opscli.command import token as token_module
 
 
 MatchGroup = collections.namedtuple(
@@ -62,31 +86,70 @@ MatchGroup = collections.namedtuple(
 class SubTree(collections.OrderedDict):
 
     def __init__(self):
+        self._index = None
         super(SubTree, self).__init__(self)
         self.group = None
 
+    def __setitem__(self, key, value, *args, **kwargs):
+        self._index = None
+        super(SubTree, self).__setitem__(key, value, *args, **kwargs)
+
+    def __delitem__(self, key, *args, **kwargs):
+        self._index = None
+        super(SubTree, self).__delitem__(key, *args, **kwargs)
+
+    def __reduce__(self):
+        # The branch index is left out and rebuilt when needed.
+        return (self.__class__, (), {'group': self.group}, None,
+                self.iteritems())
+
+    def build_index(self):
+        """Index the branches, see "Branch index" above.
+
+        The index is (keys, literals, others) where keys are the sorted
+        upper-cased literal strings, literals the (position, branch) for
+        each key and others the (position, token, branch) for other tokens.
+        """
+        literals = []
+        others = []
+        for position, (token, branch) in enumerate(self.iteritems()):
+            # Subclasses may match differently, so only index the plain type
+            if type(token) is token_module.LiteralType:
+                literals.append((token.string.upper(), position, branch))
+            else:
+                others.append((position, token, branch))
+        literals.sort(key=operator.itemgetter(0, 1))
+        keys = [key for key, _, _ in literals]
+        literals = [(position, branch) for _, position, branch in literals]
+        self._index = (keys, literals, others)
+        return self._index
+
+    def branches(self, word):
+        """Returns the branches whose token matches word, in tree order."""
+        keys, literals, others = self._index or self.build_index()
+        folded = word.upper()
+        found = []
+        i = bisect.bisect_left(keys, folded)
+        while i < len(keys) and keys[i].startswith(folded):
+            found.append(literals[i])
+            i += 1
+        for position, token, branch in others:
+            if token == word:
+                found.append((position, branch))
+        if len(found) > 1:
+            found.sort(key=operator.itemgetter(0))
+        return [branch for _, branch in found]
+
     def match(self, words, prefix=False):
         """Returns match groups that match the given words.
 
         @args prefix If true, only require that words is a subset.
         @yields MatchGroup
         """
-        if not words:
-            if self.group:
-                yield self.group
-            if prefix:
-                # Grab all available commands on the subtrees
-                for branch in self.itervalues():
-                    for match in branch.match([], prefix=True):
-                        yield match
-            return
+        return self.walk(prefix).extend(words).matches()
 
-        word = words[0]
-        for token, branch in self.iteritems():
-            if token != word:
-                continue
-            for match in branch.match(words[1:], prefix):
-                yield match
+    def walk(self, prefix=False):
+        return Walk([self], prefix)
 
 
 class Tree(SubTree):
@@ -95,10 +158,99 @@ class Tree(SubTree):
         super(Tree, self).__init__()
 
     def add(self, group):
-        combined = list(group.primary + group.secondary)
+        combined = list(group.primary)
+        if not isinstance(group.secondary, token_module.Grammar):
+            combined += group.secondary
         tree = self
         for token in combined:
             tree = tree.setdefault(token, SubTree())
         # Should be no duplicates
         assert tree.group is None
         tree.group = group
+
+
+class Chain(object):
+    """Several trees matched in order as if they were one."""
+
+    def __init__(self, *trees):
+        self.trees = trees
+
+    def __iter__(self):
+        for tree in self.trees:
+            for token in tree:
+                yield token
+
+    def match(self, words, prefix=False):
+        return self.walk(prefix).extend(words).matches()
+
+    def walk(self, prefix=False):
+        return Walk(self.trees, prefix)
+
+
+class Walk(object):
+    """Matching of trees one word at a time.
+
+    Walks are immutable, so the walk for the start of a line can be kept
+    and extended as more words are typed.
+
+    A walk keeps a cursor for every place in the trees that matches the
+    words so far, in the order the matches will be returned. A cursor is
+    (subtree, None, None) or, inside the grammar of a match group,
+    (None, group, threads).
+    """
+
+    def __init__(self, trees, prefix=False, cursors=None):
+        self.prefix = prefix
+        if cursors is None:
+            cursors = [(tree, None, None) for tree in trees]
+        self.cursors = cursors
+
+    def advance(self, word):
+        """Returns the walk after matching one more word."""
+        cursors = []
+        for tree, group, threads in self.cursors:
+            if tree is None:
+                threads = group.secondary.step(threads, word, self.prefix)
+                if threads:
+                    cursors.append((None, group, threads))
+                continue
+            group = tree.group
+            if group and isinstance(group.secondary, token_module.Grammar):
+                # The word may be an option of this command
+                grammar = group.secondary
+                threads = grammar.step(grammar.start(self.prefix), word,
+                                       self.prefix)
+                if threads:
+                    cursors.append((None, group, threads))
+            for branch in tree.branches(word):
+                cursors.append((branch, None, None))
+        return Walk(None, self.prefix, cursors)
+
+    def extend(self, words):
+        walk = self
+        for word in words:
+            if not walk.cursors:
+                break
+            walk = walk.advance(word)
+        return walk
+
+    def matches(self):
+        """Yields the match groups for the words matched."""
+        for tree, group, threads in self.cursors:
+            if tree is None:
+                for secondary in group.secondary.finish(threads, self.prefix):
+                    yield MatchGroup(group.primary, secondary, group.value)
+                continue
+            group = tree.group
+            if group and isinstance(group.secondary, token_module.Grammar):
+                grammar = group.secondary
+                for secondary in grammar.finish(grammar.start(self.prefix),
+                                                self.prefix):
+                    yield MatchGroup(group.primary, secondary, group.value)
+            elif group:
+                yield group
+            if self.prefix:
+                # Grab all available commands on the subtrees
+                for branch in tree.itervalues():
+                    for match in branch.match([], prefix=True):
+                        yield match
@@ -37,6 +37,30 @@ print expected == list(dump(tree))
 print len(list(tree.match(('show', 'aaa')))) == 1
 print len(list(tree.match(('show', ), prefix=True))) == 3
 
+# Matching is case insensitive and by prefix
+print len(list(tree.match(('SH', 'O'), prefix=True))) == 1
+print len(list(tree.match(('show', 'x')))) == 0
+
+
+class AnyType(token.Token):
+    def match(self, word):
+        return True
+
+    def transform(self, word):
+        return word
+
+# Non-literal tokens keep their place in the insertion order
+mixed = match.Tree()
+mixed.add(match.MatchGroup([L('bb')], [], 1))
+mixed.add(match.MatchGroup([AnyType()], [], 2))
+mixed.add(match.MatchGroup([L('ba')], [], 3))
+print [g.value for g in mixed.match(('b',))] == [1, 2, 3]
+print [g.value for g in mixed.match(('c',))] == [2]
+
+# Adding to the tree after matching updates the index
+mixed.add(match.MatchGroup([L('c')], [], 4))
+print [g.value for g in mixed.match(('c',))] == [2, 4]
+
 #print grammar.match('test', 'foo') # == True
 #print grammar.match('test', 'foo', 'bar') # == False
 
@@ -30,37 +30,182 @@ Usage:
     print result.error
 """
 import collections
-import pyparsing as p
+import re
 
-Segment = (
-        p.QuotedString('\'', escChar='\\') |
-        p.QuotedString('"', escChar='\\') |
-        p.CharsNotIn(' |'))
 
-# CommandEnd forbids trailing space
-CommandEnd = p.ZeroOrMore(Segment + p.Suppress(p.White())) + Segment
-
-# CommandPiped requires '|' at end, but ' |' is also fine
-CommandPiped = p.OneOrMore(Segment + p.Suppress(p.ZeroOrMore(p.White()))) + p.Suppress(p.Literal('|'))
-
-# A command consists of 'Command' or 'Command | Command'
-Grammar = p.LineStart() + p.ZeroOrMore(p.Group(CommandPiped)) + p.Group(CommandEnd) + p.LineEnd()
+Whitespace = re.compile(r'[ \t\r\n]*')
+# Anything up to a space or a pipe is a word, if it isn't a quoted string.
+Word = re.compile(r'[^ |]+')
+Quoted = {
+    '\'': re.compile(r"'((?:[^'\n\r\\]|\\.)*)'"),
+    '"': re.compile(r'"((?:[^"\n\r\\]|\\.)*)"'),
+}
+Escape = re.compile(r'\\(.)')
+# A command line in a list of them separated by ';', see split_lines().
+Line = re.compile(r"""(?:'(?:[^'\\]|\\.)*'?|"(?:[^"\\]|\\.)*"?|[^;'"])+""")
+WHITESPACE_ESCAPES = (
+    (r'\t', '\t'),
+    (r'\n', '\n'),
+    (r'\f', '\f'),
+    (r'\r', '\r'),
+)
 
 ParseResult = collections.namedtuple(
     'ParseResult', ('success', 'error', 'commands'))
 
 
+class Error(Exception):
+    """Base error class for this module."""
+    pass
+
+
+class ParseError(Error):
+    """The command line is invalid at character loc."""
+
+    def __init__(self, string, loc, msg):
+        super(ParseError, self).__init__(string, loc, msg)
+        self.string = string
+        self.loc = loc
+        self.msg = msg
+
+    def __str__(self):
+        return '%s (at char %d), (line:1, col:%d)' % (
+            self.msg, self.loc, self.loc + 1)
+
+
+def unquote(string):
+    """Returns the contents of a quoted string with escapes resolved."""
+    if '\\' in string:
+        for escape, char in WHITESPACE_ESCAPES:
+            string = string.replace(escape, char)
+        string = Escape.sub(r'\g<1>', string)
+    return string
+
+
+def tokenize(string, loc=None):
+    """Split a line into words and pipes in a single pass.
+
+    Returns a list of (word, start, end, spaced) where word is None for a
+    pipe, and spaced tells if whitespace follows.
+
+    @args loc Where to start, at the start of a token.
+    """
+    tokens = []
+    length = len(string)
+    if loc is None:
+        loc = Whitespace.match(string).end()
+    while loc < length:
+        char = string[loc]
+        if char == '|':
+            end = loc + 1
+            word = None
+        else:
+            match = char in Quoted and Quoted[char].match(string, loc)
+            if match:
+                end = match.end()
+                word = unquote(match.group(1))
+            else:
+                end = Word.match(string, loc).end()
+                word = string[loc:end]
+        next_loc = Whitespace.match(string, end).end()
+        tokens.append((word, loc, end, next_loc > end))
+        loc = next_loc
+    return tokens
+
+
+def split_lines(string):
+    """Split command lines separated by ';', except in quoted strings."""
+    return [line.strip() for line in Line.findall(string)]
+
+
 def parse(string):
     """Parse a given unicode string."""
-    error = None
-    commands = []
-    try:
-        commands = Grammar.parseString(string)
-    except p.ParseException as e:
-        error = e
-    success = error is None
-    return ParseResult(success, error, commands)
-
-
-# This enables caching of match logic inside of p
-p.ParserElement.enablePackrat()
+    return Parser().parse(string)
+
+
+class Parser(object):
+    """Parses a line, possibly as it is being typed.
+
+    When a line extends the one parsed before, only the last token and
+    what comes after it are parsed again.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.string = u''
+        self.tokens = []
+        # Index of the first word with an unterminated quote, which may
+        # become a quoted string later
+        self.unterminated = None
+        # The words of the commands before a pipe, and the index of the pipe
+        self.piped = []
+
+    def parse(self, string):
+        string = string.expandtabs()
+        try:
+            commands = self.parse_commands(string)
+        except ParseError as e:
+            return ParseResult(False, e, [])
+        return ParseResult(True, None, commands)
+
+    def tokenize(self, string):
+        """Update the tokens for a new line."""
+        if not self.tokens or not string.startswith(self.string):
+            self.reset()
+            self.tokens = tokenize(string)
+            keep = 0
+        else:
+            # The last token may continue
+            keep = len(self.tokens) - 1
+            if self.unterminated is not None:
+                keep = min(keep, self.unterminated)
+                self.unterminated = None
+            while self.piped and self.piped[-1][1] >= keep:
+                self.piped.pop()
+            loc = self.tokens[keep][1]
+            del self.tokens[keep:]
+            self.tokens.extend(tokenize(string, loc))
+        self.string = string
+
+        for i in xrange(keep, len(self.tokens)):
+            word, start, _, _ = self.tokens[i]
+            char = string[start]
+            if (word is not None and char in Quoted and
+                    not Quoted[char].match(string, start)):
+                self.unterminated = i
+                break
+
+    def parse_commands(self, string):
+        loc = Whitespace.match(string).end()
+        if loc:
+            self.reset()
+            raise ParseError(string, loc, 'Expected start of line')
+        self.tokenize(string)
+
+        # Commands up to the last pipe that was kept are unchanged
+        command = []
+        first = self.piped[-1][1] + 1 if self.piped else 0
+        for i in xrange(first, len(self.tokens)):
+            word, start, end, spaced = self.tokens[i]
+            if word is not None:
+                command.append((word, end, spaced))
+            elif command:
+                self.piped.append(([word for word, _, _ in command], i))
+                command = []
+            else:
+                raise ParseError(string, start, 'Expected word')
+
+        # Piped commands can have quoted strings next to other words, but the
+        # last command needs whitespace between all words and none at the end.
+        for i, (_, end, spaced) in enumerate(command):
+            if not spaced:
+                break
+        else:
+            raise ParseError(string, len(string), 'Expected word')
+        if i != len(command) - 1:
+            raise ParseError(string, end, 'Expected end of line')
+        commands = [words for words, _ in self.piped]
+        commands.append([word for word, _, _ in command])
+        return commands
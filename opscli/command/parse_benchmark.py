@@ -0,0 +1,79 @@
+"""
+Times parse.parse() against the pyparsing grammar it replaced.
+
+The grammar is kept here, as it was, to compare with. pyparsing isn't a
+requirement of ops-cli any more, so it has to be installed to run this.
+
+Usage:
+  PYTHONPATH=. python opscli/command/parse_benchmark.py
+"""
+import sys
+import time
+
+try:
+    import pyparsing as p
+except ImportError:
+    p = None
+
+from opscli.command import parse
+
+
+LINES = (
+    ('short', u'show running-config'),
+    ('piped', u'show running-config | include hostname | exclude "foo bar"'),
+    ('long', u' '.join([u'description', u'"%s"' % (u'x \\" ' * 100)] +
+                       [u'word%d' % i for i in range(200)])),
+)
+
+# Calls per line, fewer for long lines.
+CALLS = 2000
+LONG_CALLS = 50
+
+
+def pyparsing_grammar():
+    Segment = (
+            p.QuotedString('\'', escChar='\\') |
+            p.QuotedString('"', escChar='\\') |
+            p.CharsNotIn(' |'))
+    CommandEnd = p.ZeroOrMore(Segment + p.Suppress(p.White())) + Segment
+    CommandPiped = (
+            p.OneOrMore(Segment + p.Suppress(p.ZeroOrMore(p.White()))) +
+            p.Suppress(p.Literal('|')))
+    p.ParserElement.enablePackrat()
+    return (p.LineStart() + p.ZeroOrMore(p.Group(CommandPiped)) +
+            p.Group(CommandEnd) + p.LineEnd())
+
+
+def per_call(function, line, calls):
+    """Returns the microseconds function(line) takes."""
+    start = time.time()
+    for _ in xrange(calls):
+        function(line)
+    return (time.time() - start) / calls * 1e6
+
+
+def main():
+    if p is None:
+        print 'pyparsing is needed to compare with: pip install pyparsing'
+        sys.exit(1)
+    grammar = pyparsing_grammar()
+
+    def old_parse(line):
+        # Every line is parsed for the first time in the shell
+        p.ParserElement.resetCache()
+        return grammar.parseString(line)
+
+    print '%-8s %6s %12s %12s' % ('line', 'chars', 'pyparsing', 'tokenizer')
+    for name, line in LINES:
+        expected = [list(command) for command in old_parse(line)]
+        if parse.parse(line).commands != expected:
+            print '%s: the results differ' % name
+            sys.exit(1)
+        calls = CALLS if len(line) < 100 else LONG_CALLS
+        print '%-8s %6d %10.1fus %10.1fus' % (
+            name, len(line), per_call(old_parse, line, calls),
+            per_call(parse.parse, line, calls))
+
+
+if __name__ == '__main__':
+    main()
@@ -30,3 +30,34 @@ for data in tests:
     expected = [x.strip().split(' ') for x in data.split('|')]
     if not result.error:
         print data, str(result.commands) == str(expected)
+
+# Escapes in quoted strings
+print parse.parse(u'say "a \\" b" \'\\t\\\\\'').commands == [
+    ['say', 'a " b', '\t\\']]
+
+# Quoted strings can be next to other words, except in the last command
+print parse.parse(u'a "b"c | d').commands == [['a', 'b', 'c'], ['d']]
+print parse.parse(u'a "b"c').error.loc == 5
+
+# Unterminated quotes are part of the word
+print parse.parse(u'a "b c').commands == [['a', '"b', 'c']]
+
+# Error positions
+print parse.parse(u'test ').error.loc == 5
+print parse.parse(u'  test').error.loc == 2
+print parse.parse(u'a | | b').error.loc == 4
+print parse.parse(u'').error.loc == 0
+
+# Lines can be parsed as they are typed
+def summary(result):
+    return result.success, result.error and result.error.loc, result.commands
+
+parser = parse.Parser()
+for line in (u'show "a b" | inc "x', u'show "a b" | inc "x y"'):
+    print all(summary(parser.parse(line[:i])) == summary(parse.parse(line[:i]))
+              for i in range(len(line) + 1))
+
+# Several command lines can be given separated by ';'
+print parse.split_lines(u"conf t; motd 'a; b';exit") == [
+    'conf t', "motd 'a; b'", 'exit']
+print parse.split_lines(u'a "b\\";"; c') == ['a "b\\";"', 'c']
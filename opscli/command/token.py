@@ -55,6 +55,23 @@ Example:
 combinations = list(LiteralType("foo") + [ LiteralType("bar") ])
 combinations[0] => [LiteralType("foo")]
 combinations[0] => [LiteralType("foo"), LiteralType("bar")]
+
+# Compiling conditions
+The number of combinations grows exponentially with the number of optional
+parts, so conditions that are matched against often are compiled into a
+Grammar instead. A grammar is an automaton with a state for every token in
+the condition that is walked one word at a time, keeping every possible
+position in the condition at once.
+
+Example:
+
+grammar = compile(LiteralType("foo") + [ LiteralType("bar") ])
+list(grammar.match(['f'])) => [[LiteralType("foo")]]
+list(grammar.match(['f'], prefix=True))
+  => [[LiteralType("foo")], [LiteralType("foo"), LiteralType("bar")]]
+
+Paths are returned in the same order as iterating over the combinations
+would find them.
 """
 import abc
 
@@ -210,3 +227,140 @@ def construct(operand):
         return operand
     else:
         return InOrder(operand)
+
+
+class Grammar(object):
+    """A condition compiled to a non-deterministic automaton.
+
+    States are numbered, with 0 as the start. Each state has a list of
+    (token, state) transitions taken when the token matches a word, and a
+    list of states that can be moved to without consuming a word. Both are
+    kept in the order the combinations are generated in.
+    """
+
+    def __init__(self):
+        self.transitions = []
+        self.epsilons = []
+        self.start_state = self.state()
+        self.accept = None
+
+    def __getstate__(self):
+        return (self.transitions, self.epsilons, self.start_state,
+                self.accept)
+
+    def __setstate__(self, state):
+        (self.transitions, self.epsilons, self.start_state,
+         self.accept) = state
+
+    def state(self):
+        self.transitions.append([])
+        self.epsilons.append([])
+        return len(self.transitions) - 1
+
+    def add(self, operand, state):
+        """Add the operand starting from state and return its end state."""
+        if isinstance(operand, Token):
+            end = self.state()
+            self.transitions[state].append((operand, end))
+            return end
+        if isinstance(operand, InOrder):
+            for child in operand.operands:
+                state = self.add(child, state)
+            return state
+        if isinstance(operand, OneOf):
+            return self.add_alternatives(operand.operands, state)
+        if isinstance(operand, Optional):
+            # The combination without the operand comes first.
+            end = self.state()
+            inner = self.state()
+            self.epsilons[state].extend((end, inner))
+            self.epsilons[self.add(operand.operands[0], inner)].append(end)
+            return end
+        if isinstance(operand, list):
+            # A plain combination of tokens
+            for child in operand:
+                state = self.add(child, state)
+            return state
+        if isinstance(operand, tuple):
+            # A sequence of combinations
+            return self.add_alternatives(operand, state)
+        raise TypeError('Cannot compile %r' % (operand, ))
+
+    def add_alternatives(self, operands, state):
+        end = self.state()
+        for operand in operands:
+            branch = self.state()
+            self.epsilons[state].append(branch)
+            self.epsilons[self.add(operand, branch)].append(end)
+        return end
+
+    def closure(self, threads, prefix=False):
+        """Follow the epsilons from the given (state, path) threads.
+
+        Only the first thread to reach a state is kept, the others would
+        match the same words from there on. When prefix matching, the last
+        token of the path is a completion candidate so threads are only
+        merged if their last token is the same.
+        """
+        seen = set()
+        result = []
+        stack = list(reversed(threads))
+        while stack:
+            state, path = stack.pop()
+            key = state
+            if prefix and path:
+                key = (state, id(path[-1]))
+            if key in seen:
+                continue
+            seen.add(key)
+            if self.transitions[state] or state == self.accept:
+                result.append((state, path))
+            for target in reversed(self.epsilons[state]):
+                stack.append((target, path))
+        return result
+
+    def start(self, prefix=False):
+        """Returns the threads before any words are matched."""
+        return self.closure([(self.start_state, [])], prefix)
+
+    def step(self, threads, word, prefix=False):
+        """Returns the threads after matching one more word."""
+        matched = []
+        for state, path in threads:
+            for token, target in self.transitions[state]:
+                if token == word:
+                    matched.append((target, path + [token]))
+        return self.closure(matched, prefix)
+
+    def finish(self, threads, prefix=False):
+        """Yields the tokens of the combinations the threads matched.
+
+        @args prefix If true, also yield the combinations that words is the
+                     start of, extended by their next token.
+        """
+        for state, path in threads:
+            if state == self.accept:
+                yield path
+            if prefix:
+                for token, _ in self.transitions[state]:
+                    yield path + [token]
+
+    def match(self, words, prefix=False):
+        """Yields the tokens of the combinations matching the words."""
+        threads = self.start(prefix)
+        for word in words:
+            threads = self.step(threads, word, prefix)
+            if not threads:
+                return []
+        return self.finish(threads, prefix)
+
+
+def compile(options):
+    """Compile command options to a Grammar.
+
+    The options can be a Condition, a Token, or a sequence of token
+    combinations like command.Command.options.
+    """
+    grammar = Grammar()
+    grammar.accept = grammar.add(options, grammar.start_state)
+    return grammar
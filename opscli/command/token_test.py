@@ -24,3 +24,24 @@ grammar = token.construct(Any() + StartsWithF() + [ Any() + [ StartsWithF() ] ])
 
 print str(grammar) # == Any StartsWithF [ Any [ StartsWithF ] ]
 print list(grammar) # == [[Any, StartsWithF], [Any, StartsWithF, Any], [Any, StartsWithF, Any, StartsWithF ]]
+
+# Compiled grammars match the same combinations
+L = token.LiteralType
+grammar = token.compile(L('a') + [ L('b') ] + (L('c') | L('d')))
+
+
+def paths(words, prefix=False):
+    return [[str(x) for x in path] for path in grammar.match(words, prefix)]
+
+print paths(['a', 'c']) == [['a', 'c']]
+print paths(['a', 'b', 'd']) == [['a', 'b', 'd']]
+print paths(['a', 'b']) == []
+print paths(['a', 'x']) == []
+print paths(['a'], prefix=True) == [['a', 'c'], ['a', 'd'], ['a', 'b']]
+print paths([], prefix=True) == [['a']]
+print [str(x) for x in next(token.compile((list(), )).match([]))] == []
+
+# The size of a grammar is linear in the number of optional parts
+options = token.construct([L(str(i)) for i in range(16)])
+print len(token.compile(options).transitions) < 100
+print len(paths(['a'] * 16)) == 0
@@ -1,26 +1,62 @@
 
+import contextlib
+import fcntl
 import os
+import select
 import sys
+import termios
+import time
+import tty
 
 from pyrepl.reader import Reader
 from pyrepl.unix_console import UnixConsole
 from pyrepl.historical_reader import HistoricalReader
+from pyrepl.historical_reader import ISEARCH_DIRECTION_FORWARDS
 import pyrepl.commands
 
+from opscli import history
 from opscli import linehelper
+from opscli import pipe
 
 
 HISTORY_FILE = '~/.opscli_history'
 
-# Number of lines to remember across sessions.
+# Number of lines to remember across sessions. They are all read when the
+# shell starts, so a longer history (ops-cli -H) makes it start slower.
 HISTORY_SIZE = 1000
 
+# The history file is read backwards this many bytes at a time.
+HISTORY_BLOCK_SIZE = 8192
+
+# Command output is written once this many characters are waiting, or once
+# this many seconds have passed since it was last written.
+OUTPUT_BUFFER_SIZE = 16384
+OUTPUT_FLUSH_INTERVAL = 0.1
+
+# Spaces between columns of completions, see columns().
+COLUMN_SPACING = 2
+
+# Number of completion layouts to remember.
+LAYOUT_CACHE_SIZE = 32
+
+# Seconds to wait for the rest of an escape sequence, see read_key().
+ESCAPE_TIMEOUT = 0.05
+
 class ExtendedHistoricalReader(HistoricalReader):
 
     def __init__(self, *args, **kwargs):
         super(ExtendedHistoricalReader, self).__init__(*args, **kwargs)
         self.fix_syntax_table()
         self.last_event = None
+        # Searched instead of history when set, see HistoryFile
+        self.history_index = None
+        for command in (history_search_backward, history_search_forward):
+            self.commands[command.__name__.replace('_', '-')] = command
+
+    def collect_keymap(self):
+        return super(ExtendedHistoricalReader, self).collect_keymap() + (
+            (r'\<page up>', 'history-search-backward'),
+            (r'\<page down>', 'history-search-forward'))
 
     def fix_syntax_table(self):
         """The default pyrepl syntax table only considers a-z as word
@@ -40,22 +76,321 @@ class ExtendedHistoricalReader(HistoricalReader):
         cause readline to send a beep."""
         self.console.beep()
 
+    def finish(self):
+        if self.history_index is None:
+            super(ExtendedHistoricalReader, self).finish()
+        else:
+            # HistoryFile.append() adds the line to the index
+            Reader.finish(self)
+
+    def isearch_next(self):
+        """Find the next line with the search term, like ctrl-r."""
+        if self.history_index is None:
+            return super(ExtendedHistoricalReader, self).isearch_next()
+        term = self.isearch_term
+        forwards = self.isearch_direction == ISEARCH_DIRECTION_FORWARDS
+        # The rest of the current line first
+        line = self.get_unicode()
+        if forwards:
+            pos = line.find(term, self.pos + 1)
+        else:
+            pos = line.rfind(term, 0, self.pos + len(term) - 1)
+        if pos != -1:
+            self.pos = pos
+            self.dirty = 1
+            return
+        i = self.history_index.search(term, self.historyi, forwards)
+        self.select_found(i, term, forwards)
+
+    def history_search(self, forwards):
+        """Find the next line that starts with the text before the
+        cursor."""
+        prefix = u''.join(self.buffer[:self.pos])
+        index = self.history_index
+        if index is None:
+            index = history.Index(self.history)
+        i = index.search_prefix(prefix, self.historyi, forwards)
+        self.select_found(i, prefix, forwards)
+        if i is not None:
+            self.pos = len(prefix)
+
+    def select_found(self, i, term, forwards):
+        if i is None:
+            self.error('not found')
+            return
+        # The line as it was entered, not as it was edited since
+        self.transient_history.pop(i, None)
+        self.select_item(i)
+        line = self.get_unicode()
+        self.pos = line.find(term) if forwards else line.rfind(term)
+
+
+class history_search_backward(pyrepl.commands.Command):
+    def do(self):
+        self.reader.history_search(False)
+
+
+class history_search_forward(pyrepl.commands.Command):
+    def do(self):
+        self.reader.history_search(True)
+
+
+def read_tail(f, count):
+    """Returns the last count lines of a file, reading it from the end.
+
+    Returns (lines, offset) where offset is where the lines start.
+    """
+    f.seek(0, os.SEEK_END)
+    offset = f.tell()
+    blocks = []
+    newlines = 0
+    # One more newline than lines, for the end of the line before them
+    while offset > 0 and newlines <= count:
+        size = min(HISTORY_BLOCK_SIZE, offset)
+        offset -= size
+        f.seek(offset)
+        block = f.read(size)
+        newlines += block.count('\n')
+        blocks.append(block)
+    blocks.reverse()
+    data = ''.join(blocks)
+    if data.endswith('\n'):
+        data = data[:-1]
+    if not data:
+        return [], offset
+    lines = data.split('\n')
+    if offset > 0 or len(lines) > count:
+        # The first line can be cut off, or one too many
+        lines = lines[1:]
+        lines = lines[-count:]
+    offset += len(data) - len('\n'.join(lines))
+    return lines, offset
+
+
+@contextlib.contextmanager
+def locked(f, operation):
+    """Hold a flock() of f, LOCK_SH or LOCK_EX."""
+    fcntl.flock(f.fileno(), operation)
+    try:
+        yield
+    finally:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
 
 class HistoryFile(object):
+    """Keeps the history of a reader in a file shared by sessions.
+
+    Lines are appended to the file as they are entered, so they aren't
+    lost if the shell is killed, and other sessions pick them up before
+    they read their next line. Sessions lock the file while they write it.
+    Only the last HISTORY_SIZE lines are read, from the end of the file.
+    Once the lines before them take up more room than they do, the file is
+    rewritten to just those.
+
+    The lines are kept in a history.Index, which the reader searches.
+    """
 
     def __init__(self, reader):
         self.histfile = os.path.expanduser(HISTORY_FILE)
         self.reader = reader
+        self.file = None
+        self.index = None
+        # Bytes of the file read so far
+        self.size = 0
 
     def __enter__(self):
-        if os.path.exists(self.histfile):
-            with open(self.histfile) as f:
-                self.reader.history = f.read().split('\n')[:-1]
+        self.open()
+        return self
 
     def __exit__(self, unused_type, unused_value, unused_traceback):
-        with open(self.histfile, 'w') as f:
-            f.write('\n'.join(self.reader.history[-HISTORY_SIZE:]))
-            f.write('\n')
+        self.file.close()
+
+    def open(self):
+        """Open the file and read its last lines into a new index."""
+        while True:
+            if self.file is not None:
+                self.file.close()
+            self.file = open(self.histfile, 'a+b')
+            with locked(self.file, fcntl.LOCK_SH):
+                if self.replaced():
+                    continue
+                size = os.fstat(self.file.fileno()).st_size
+                lines, offset = read_tail(self.file, HISTORY_SIZE)
+            if offset <= size - offset:
+                break
+            self.compact()
+        self.size = size
+        data = '\n'.join(lines)
+        try:
+            # ASCII strings work the same as unicode ones
+            data.decode('ascii')
+        except UnicodeDecodeError:
+            lines = data.decode('utf-8', 'replace').split('\n')
+        self.index = history.Index(lines, self.histfile + '.index')
+        self.reader.history = self.index.lines
+        self.reader.history_index = self.index
+
+    def replaced(self):
+        """Returns if another session has replaced the file, see
+        compact()."""
+        try:
+            inode = os.stat(self.histfile).st_ino
+        except OSError:
+            return True
+        return inode != os.fstat(self.file.fileno()).st_ino
+
+    def read_new(self):
+        """Add the lines other sessions appended to the index."""
+        self.file.seek(self.size)
+        data = self.file.read()
+        end = data.rfind('\n') + 1
+        self.size += end
+        for line in data[:end].decode('utf-8', 'replace').split('\n')[:-1]:
+            self.index.append(line)
+
+    def refresh(self):
+        """Pick up the lines other sessions entered."""
+        if self.replaced():
+            self.open()
+        elif os.fstat(self.file.fileno()).st_size > self.size:
+            with locked(self.file, fcntl.LOCK_SH):
+                self.read_new()
+
+    def append(self, line):
+        """Save a line that was entered."""
+        if isinstance(line, unicode):
+            data = line.encode('utf-8')
+        else:
+            data, line = line, line.decode('utf-8', 'replace')
+        while True:
+            with locked(self.file, fcntl.LOCK_EX):
+                if not self.replaced():
+                    # Lines of other sessions go before this one
+                    self.read_new()
+                    self.file.seek(0, os.SEEK_END)
+                    self.file.write(data + '\n')
+                    self.file.flush()
+                    self.size += len(data) + 1
+                    break
+            self.open()
+        self.index.append(line)
+        if len(self.index) > 2 * HISTORY_SIZE:
+            self.compact()
+            self.open()
+
+    def compact(self):
+        """Replace the file with its last HISTORY_SIZE lines.
+
+        Other sessions wait for the lock of the file being replaced, then
+        find that it was, and open the new one.
+        """
+        with locked(self.file, fcntl.LOCK_EX):
+            if self.replaced():
+                return
+            lines, _ = read_tail(self.file, HISTORY_SIZE)
+            temporary = '%s.%d' % (self.histfile, os.getpid())
+            with open(temporary, 'wb') as f:
+                for line in lines:
+                    f.write(line + '\n')
+            os.rename(temporary, self.histfile)
+
+
+def columns(items, width):
+    """Returns items in columns that fit in width, in order down the
+    columns like ls.
+
+    Columns are as wide as the longest item, so a single pass finds the
+    layout.
+    """
+    if not items:
+        return ''
+    column_width = max(len(item) for item in items) + COLUMN_SPACING
+    count = max(1, width // column_width)
+    rows = (len(items) + count - 1) // count
+    lines = []
+    for row in xrange(rows):
+        line = ''.join(item.ljust(column_width) for item in items[row::rows])
+        lines.append(line.rstrip())
+    return '\n'.join(lines)
+
+
+def read_key(fd):
+    """Reads a key press from fd.
+
+    Keys like the arrows and PgUp/PgDn send an escape sequence of several
+    bytes, e.g. ESC [ A for up. It is read in full and returned as one
+    key, so its other bytes aren't taken for more keys. A lone escape is
+    returned once nothing follows it for ESCAPE_TIMEOUT seconds.
+    """
+    def more():
+        return select.select([fd], [], [], ESCAPE_TIMEOUT)[0]
+
+    key = os.read(fd, 1)
+    if key != '\x1b' or not more():
+        return key
+    key += os.read(fd, 1)
+    if key[1:] == 'O':
+        # SS3: one more byte
+        if more():
+            key += os.read(fd, 1)
+    elif key[1:] == '[':
+        # CSI: parameters and intermediates up to a final byte
+        while more():
+            char = os.read(fd, 1)
+            key += char
+            if not char or '\x40' <= char <= '\x7e':
+                break
+    return key
+
+
+class Pager(object):
+    """Writes lines a screen at a time.
+
+    When the screen is full, --More-- is shown and a key is read: space
+    shows the next screen, enter the next line and any other key stops.
+    Output is only read as far as it is shown, and closed when stopped.
+    """
+
+    PROMPT = ' --More-- '
+
+    def __init__(self, height, width, read_key, stream=sys.stdout):
+        self.height = height
+        self.width = width
+        self.read_key = read_key
+        self.stream = stream
+
+    def more(self):
+        """Show the prompt and return the key pressed."""
+        self.stream.write(self.PROMPT)
+        self.stream.flush()
+        key = self.read_key()
+        self.stream.write('\r' + ' ' * len(self.PROMPT) + '\r')
+        return key
+
+    def page(self, output):
+        lines = pipe.lines(output)
+        # Rows of the screen in use, including wrapped lines
+        rows = 0
+        try:
+            for line in lines:
+                line_rows = max(1, (len(line) + self.width - 1) // self.width)
+                # The last row is kept for the prompt
+                if rows and rows + line_rows >= self.height:
+                    key = self.more()
+                    if key == ' ':
+                        rows = 0
+                    elif key in ('\r', '\n'):
+                        rows = self.height - 1 - line_rows
+                    else:
+                        break
+                self.stream.write(line + '\r\n')
+                rows += line_rows
+        except KeyboardInterrupt:
+            self.stream.write('^C\r\n')
+        lines.close()
+        if hasattr(output, 'close'):
+            output.close()
+        self.stream.flush()
 
 
 class PyreplConsole(object):
@@ -71,11 +406,22 @@ class PyreplConsole(object):
         self.bind('qhelp', self.qhelp)
         self.prompt_base = prompt
         self.helper = helper
+        # Long output is shown a screen at a time on a terminal
+        self.paging = sys.stdout.isatty()
+        # Completions in columns, by items and width
+        self.layouts = linehelper.LRUCache(LAYOUT_CACHE_SIZE)
 
         self.output(motd)
 
         super(PyreplConsole, self).__init__()
 
+    def set_prompt_base(self, prompt):
+        """Change the prompt. This can be called from another thread while
+        a line is being read; the prompt is redrawn on the next key."""
+        self.prompt_base = prompt
+        self.reader.ps1 = self.prompt_base + self.helper.prompt
+        self.reader.dirty = 1
+
     def interrupt(self, unused_line):
         raise KeyboardInterrupt
 
@@ -115,8 +461,17 @@ class PyreplConsole(object):
 
     def fmt_cols(self, data):
         """Arrange strings into columns depending on terminal width and the
-        longest string."""
-        return '    '.join(data)
+        longest string.
+
+        pyrepl keeps the width of the console up to date as the terminal
+        is resized. The same completions are only laid out once for it.
+        """
+        key = (tuple(data), self.reader.console.width)
+        text = self.layouts.get(key)
+        if text is None:
+            text = columns(data, key[1])
+            self.layouts.put(key, text)
+        return text
 
     def bind(self, action, function):
         class command(pyrepl.commands.Command):
@@ -126,13 +481,15 @@ class PyreplConsole(object):
         self.reader.commands[action] = command
 
     def loop(self):
-       with HistoryFile(self.reader):
+       with HistoryFile(self.reader) as history_file:
             while True:
                 try:
+                    history_file.refresh()
                     self.reader.ps1 = (
                             self.prompt_base + self.helper.prompt)
                     read = self.reader.readline().strip()
                     if read:
+                        history_file.append(read)
                         yield read
                 except EOFError:
                     # ctrl-d quits the shell.
@@ -154,3 +511,69 @@ class PyreplConsole(object):
         """Called when there is something to output returned by a command."""
         sys.stdout.write((' '.join(values) + '\n').replace('\n', '\r\n'))
         sys.stdout.flush()
+
+    def write(self, output):
+        """Write the output of a command as it is produced.
+
+        Output is a string or an iterable of strings of one or more lines,
+        like for pipe.lines(). Only a bounded amount of it is held at a
+        time. ctrl-c stops the command. On a terminal it is paged, see
+        Pager.
+        """
+        if output is None:
+            return
+        if self.paging:
+            height, width = self.reader.console.getheightwidth()
+            Pager(height, width, self.read_key).page(output)
+            return
+        if isinstance(output, basestring):
+            output = (output, )
+        output = iter(output)
+        buffered = []
+        size = 0
+        flushed = time.time()
+        try:
+            for text in output:
+                if not text:
+                    continue
+                if len(text) > OUTPUT_BUFFER_SIZE:
+                    # Long texts are written a piece at a time
+                    self.flush(buffered)
+                    for start in xrange(0, len(text), OUTPUT_BUFFER_SIZE):
+                        buffered.append(
+                            text[start:start + OUTPUT_BUFFER_SIZE])
+                        self.flush(buffered)
+                    size = 0
+                    flushed = time.time()
+                else:
+                    buffered.append(text)
+                    size += len(text)
+                if text[-1] != '\n':
+                    buffered.append('\n')
+                    size += 1
+                if (size >= OUTPUT_BUFFER_SIZE or
+                        time.time() - flushed >= OUTPUT_FLUSH_INTERVAL):
+                    self.flush(buffered)
+                    size = 0
+                    flushed = time.time()
+        except KeyboardInterrupt:
+            if hasattr(output, 'close'):
+                output.close()
+            buffered.append('^C\n')
+        self.flush(buffered)
+
+    def read_key(self):
+        """Wait for a key press while no line is being read."""
+        fd = sys.stdin.fileno()
+        mode = termios.tcgetattr(fd)
+        try:
+            tty.setcbreak(fd)
+            return read_key(fd)
+        finally:
+            termios.tcsetattr(fd, termios.TCSADRAIN, mode)
+
+    def flush(self, buffered):
+        """Write out and empty a list of strings."""
+        sys.stdout.write(''.join(buffered).replace('\n', '\r\n'))
+        sys.stdout.flush()
+        del buffered[:]
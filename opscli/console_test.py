@@ -0,0 +1,203 @@
+import os
+import shutil
+import StringIO
+import tempfile
+import time
+
+from opscli import console
+
+
+def run(output, keys, height=4, width=10):
+    keys = list(keys)
+    read = []
+
+    def read_key():
+        read.append(len(produced))
+        return keys.pop(0)
+
+    stream = StringIO.StringIO()
+    console.Pager(height, width, read_key, stream).page(output)
+    return stream.getvalue().replace(
+        ' --More-- \r          \r', '|').split('\r\n'), read
+
+produced = []
+
+
+def rows(count):
+    for i in range(count):
+        produced.append(i)
+        yield str(i)
+
+# A screen is shown at a time, leaving a row for the prompt
+lines, read = run(rows(5), ' ')
+print lines == ['0', '1', '2', '|3', '4', '']
+print read == [4]
+
+# Enter shows one more line
+del produced[:]
+lines, read = run(rows(5), '\r\r')
+print lines == ['0', '1', '2', '|3', '|4', '']
+
+# Other keys stop the output without reading more of it
+del produced[:]
+output = rows(100)
+lines, read = run(output, 'q')
+print lines == ['0', '1', '2', '|']
+print len(produced) == 4
+print next(output, None) is None
+
+# Long lines take several rows
+lines, read = run('x' * 25 + '\nend', ' ')
+print lines == ['x' * 25, '|end', '']
+
+# Completions are shown in columns down the screen
+items = ['a', 'bb', 'ccc', 'd', 'e', 'f', 'g']
+print console.columns(items, 12) == 'a    e\nbb   f\nccc  g\nd'
+print console.columns(items, 80) == 'a    bb   ccc  d    e    f    g'
+print console.columns(['x' * 20, 'y'], 10) == 'x' * 20 + '\ny'
+print console.columns([], 80) == ''
+
+# Escape sequences are read as one key, and nothing after them
+key_in, key_out = os.pipe()
+os.write(key_out, '\x1b[A\x1b[6~\x1bOPq\x1b')
+print console.read_key(key_in) == '\x1b[A'
+print console.read_key(key_in) == '\x1b[6~'
+print console.read_key(key_in) == '\x1bOP'
+print console.read_key(key_in) == 'q'
+print console.read_key(key_in) == '\x1b'
+os.close(key_in)
+os.close(key_out)
+
+
+class Screen(object):
+    width = 12
+
+
+class ScreenReader(object):
+    console = Screen()
+
+
+shell = console.PyreplConsole.__new__(console.PyreplConsole)
+shell.reader = ScreenReader()
+shell.layouts = console.linehelper.LRUCache(console.LAYOUT_CACHE_SIZE)
+text = shell.fmt_cols(items)
+print text == console.columns(items, 12)
+print shell.fmt_cols(list(items)) is text
+shell.reader.console.width = 80
+print shell.fmt_cols(items) == console.columns(items, 80)
+
+# Output is written once enough of it waits, or some time after the last
+# write, also of a long text
+console.OUTPUT_BUFFER_SIZE = 8
+console.OUTPUT_FLUSH_INTERVAL = 0.05
+written = []
+shell.paging = False
+shell.flush = lambda buffered: (written.append(''.join(buffered)),
+                                buffered.__delitem__(slice(None)))
+
+
+def slow():
+    time.sleep(0.06)
+    yield 'x' * 10
+    yield 'a'
+    yield 'b'
+
+shell.write(slow())
+print written == ['', 'xxxxxxxx', 'xx', '\na\nb\n']
+
+# History is read from the end of the file
+history_path = tempfile.mkdtemp()
+console.HISTORY_FILE = os.path.join(history_path, 'history')
+console.HISTORY_BLOCK_SIZE = 4
+
+
+def write_history(lines):
+    with open(console.HISTORY_FILE, 'wb') as f:
+        f.write(''.join(line + '\n' for line in lines))
+
+
+class Reader(object):
+    history = []
+
+try:
+    for size in (1, 3, 10):
+        with open(console.HISTORY_FILE, 'wb') as f:
+            f.write(''.join('line %d\n' % i for i in range(size)))
+        with open(console.HISTORY_FILE, 'rb') as f:
+            lines, offset = console.read_tail(f, 3)
+        print lines == ['line %d' % i for i in range(max(0, size - 3), size)]
+        print offset == 7 * max(0, size - 3)
+
+    # Lines are appended as they are entered
+    console.HISTORY_SIZE = 3
+    write_history(['a', 'b'])
+    reader = Reader()
+    with console.HistoryFile(reader) as history:
+        print reader.history == ['a', 'b']
+        history.append(u'c')
+        with open(console.HISTORY_FILE) as f:
+            print f.read() == 'a\nb\nc\n'
+
+    # and the file is compacted when most of it is old lines
+    write_history(['a', 'b', 'c', 'd', 'e', 'f', 'g'])
+    with console.HistoryFile(reader) as history:
+        print reader.history == ['e', 'f', 'g']
+    with open(console.HISTORY_FILE) as f:
+        print f.read() == 'e\nf\ng\n'
+    write_history(['a', 'b', 'c', 'd', 'e'])
+    with console.HistoryFile(reader) as history:
+        pass
+    with open(console.HISTORY_FILE) as f:
+        print f.read() == 'a\nb\nc\nd\ne\n'
+
+    # Lines that aren't ASCII are decoded
+    write_history(['a', u'caf\xe9'.encode('utf-8')])
+    with console.HistoryFile(reader) as history:
+        print reader.history == ['a', u'caf\xe9']
+
+    # Sessions share the file, and see each other's lines
+    console.HISTORY_SIZE = 10
+    write_history(['a'])
+    first, second = Reader(), Reader()
+    with console.HistoryFile(first) as one:
+        with console.HistoryFile(second) as two:
+            one.append(u'b')
+            two.refresh()
+            print second.history == ['a', 'b']
+            two.append(u'c')
+            one.append(u'd')
+            print first.history == ['a', 'b', 'c', 'd']
+            print second.history_index.search('b', 4) == 1
+
+            # and follow it when another one compacts it
+            for line in 'efghijklmnopqrstu':
+                one.append(line)
+            print len(first.history) == 10
+            two.refresh()
+            print second.history == first.history
+    with open(console.HISTORY_FILE) as f:
+        print f.read().split() == first.history
+
+    # Searches go through the index
+    class Console(object):
+        def beep(self):
+            pass
+
+    reader = console.ExtendedHistoricalReader(Console())
+    write_history(['show vlan', 'configure terminal', 'show interface 1'])
+    with console.HistoryFile(reader) as history:
+        reader.historyi = len(reader.history)
+        reader.buffer = list(u'sh')
+        reader.pos = 2
+        reader.history_search(False)
+        print ''.join(reader.buffer) == 'show interface 1'
+        reader.history_search(False)
+        print ''.join(reader.buffer) == 'show vlan'
+        print reader.pos == 2
+        reader.select_item(len(reader.history))
+        reader.isearch_term = u'term'
+        reader.isearch_next()
+        print ''.join(reader.buffer) == 'configure terminal'
+        print reader.pos == 10
+finally:
+    shutil.rmtree(history_path)
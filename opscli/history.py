@@ -0,0 +1,232 @@
+"""
+An index of the lines in a history, to search them without going through
+every line.
+
+Lines that were entered more than once share an entry, which remembers
+the positions they were entered at. Entries are kept in order of their
+text, for the lines that start with a prefix, and under the trigrams
+(substrings of three characters) in them, for the lines that contain a
+string. A search only looks at the entries that can match, and finds the
+nearest position of each with a bisection.
+
+Nothing is indexed until the first search, so an index is cheap to make
+for a history that is never searched.
+
+# Saved trigrams
+Finding the trigrams of every entry takes a while for a long history, so
+they can be saved in a file next to it. The file holds entry texts and
+the entries under each trigram. It can be shared by histories with other
+lines: its entries that aren't in the lines are left without positions,
+and the lines that aren't in it get indexed when it is read. It is written
+again once many of them weren't.
+
+Usage:
+  index = history.Index(['show vlan', 'configure terminal'])
+  index.append('show interface 1')
+  index.search('vlan', len(index.lines))         # 0
+  index.search_prefix('show', len(index.lines))  # 2
+"""
+import array
+import bisect
+import itertools
+import marshal
+import os
+
+from opscli import collector
+
+
+# Changes when the file of saved trigrams changes format.
+SAVED_VERSION = 1
+
+# Trigrams are saved again once this part of the entries wasn't in the
+# file they were read from.
+SAVE_RATIO = 0.25
+
+
+def trigrams(text):
+    """Returns the substrings of three characters in text."""
+    return set([text[i:i + 3] for i in xrange(len(text) - 2)])
+
+
+class Index(object):
+    """The lines of a history, in the order they were entered."""
+
+    def __init__(self, lines=(), path=None):
+        self.lines = list(lines)
+        # Where trigrams are saved, or None
+        self.path = path
+        # The text of every entry, by entry number
+        self.texts = None
+        # Entry numbers by text
+        self.entries = None
+        # Positions in lines, by entry number
+        self.positions = None
+        # Texts in order, see search_prefix()
+        self.ordered = None
+        # Arrays of entry numbers by trigram, see search()
+        self.postings = None
+        # Postings read from path, and the number of entries they cover
+        self.saved = None
+        self.saved_count = 0
+
+    def __len__(self):
+        return len(self.lines)
+
+    def append(self, line):
+        position = len(self.lines)
+        self.lines.append(line)
+        if self.texts is not None:
+            self.add(line, position)
+
+    def add(self, line, position):
+        entry = self.entries.get(line)
+        if entry is None:
+            entry = len(self.texts)
+            self.entries[line] = entry
+            self.texts.append(line)
+            self.positions.append([])
+            if self.ordered is not None:
+                bisect.insort(self.ordered, line)
+            if self.postings is not None:
+                self.post(entry)
+        self.positions[entry].append(position)
+
+    def build(self):
+        """Make the entries of the lines, starting from the saved ones."""
+        if self.texts is not None:
+            return
+        texts, saved = self.load()
+        self.make_entries(texts)
+        stale = self.positions.count([])
+        if stale > len(self.texts) - stale:
+            # Mostly entries of lines that are gone
+            texts, saved = [], None
+            self.make_entries(texts)
+        self.saved = saved
+        self.saved_count = len(texts)
+
+    def make_entries(self, texts):
+        self.texts = list(texts)
+        self.entries = dict(itertools.izip(texts, itertools.count()))
+        with collector.paused():
+            self.positions = [[] for _ in texts]
+            for position, line in enumerate(self.lines):
+                self.add(line, position)
+
+    def post(self, entry):
+        for trigram in trigrams(self.texts[entry]):
+            posting = self.postings.get(trigram)
+            if posting is None:
+                posting = self.postings[trigram] = array.array('i')
+            posting.append(entry)
+
+    def build_postings(self):
+        self.build()
+        if self.saved is not None:
+            self.postings = self.saved
+            first = self.saved_count
+        else:
+            self.postings = {}
+            first = 0
+        self.saved = None
+        with collector.paused():
+            for entry in xrange(first, len(self.texts)):
+                self.post(entry)
+        if (self.path is not None and
+                len(self.texts) - first > SAVE_RATIO * len(self.texts)):
+            self.save()
+
+    def load(self):
+        """Returns the saved texts and postings, or ([], None)."""
+        if self.path is None:
+            return [], None
+        try:
+            with open(self.path, 'rb') as f:
+                version, texts, postings = marshal.load(f)
+        except (IOError, EOFError, ValueError, TypeError):
+            return [], None
+        if version != SAVED_VERSION:
+            return [], None
+        for trigram, data in postings.iteritems():
+            posting = array.array('i')
+            posting.fromstring(data)
+            postings[trigram] = posting
+        return texts, postings
+
+    def save(self):
+        postings = dict((trigram, posting.tostring())
+                        for trigram, posting in self.postings.iteritems())
+        temporary = '%s.%d' % (self.path, os.getpid())
+        try:
+            with open(temporary, 'wb') as f:
+                marshal.dump((SAVED_VERSION, self.texts, postings), f)
+            os.rename(temporary, self.path)
+        except (IOError, OSError):
+            # Only makes the next search slower to start
+            pass
+
+    def nearest(self, entries, start, forwards):
+        """Returns the position of entries nearest to start, before it or
+        after it if forwards, or None."""
+        best = None
+        for entry in entries:
+            positions = self.positions[entry]
+            if forwards:
+                i = bisect.bisect_right(positions, start)
+                if i < len(positions) and (best is None or
+                                           positions[i] < best):
+                    best = positions[i]
+            else:
+                i = bisect.bisect_left(positions, start)
+                if i and (best is None or positions[i - 1] > best):
+                    best = positions[i - 1]
+        return best
+
+    def scan(self, match, start, forwards):
+        """Returns the position of the nearest line to start that match
+        returns True for, looking at every line."""
+        if forwards:
+            positions = xrange(start + 1, len(self.lines))
+        else:
+            positions = xrange(min(start, len(self.lines)) - 1, -1, -1)
+        for position in positions:
+            if match(self.lines[position]):
+                return position
+        return None
+
+    def search(self, term, start, forwards=False):
+        """Returns the position of the nearest line to start that contains
+        term, before it or after it if forwards, or None.
+        """
+        if len(term) < 3:
+            # Most lines match, so the nearest one is close by
+            return self.scan(lambda line: term in line, start, forwards)
+        if self.postings is None:
+            self.build_postings()
+        # Lines with term have all of its trigrams, and most lines with
+        # its rarest one have term.
+        candidates = None
+        for trigram in trigrams(term):
+            posting = self.postings.get(trigram)
+            if posting is None:
+                return None
+            if candidates is None or len(posting) < len(candidates):
+                candidates = posting
+        return self.nearest(
+            (entry for entry in candidates if term in self.texts[entry]),
+            start, forwards)
+
+    def search_prefix(self, prefix, start, forwards=False):
+        """Like search(), for lines that start with prefix."""
+        if not prefix:
+            return self.scan(lambda line: True, start, forwards)
+        if self.ordered is None:
+            self.build()
+            self.ordered = sorted(self.texts)
+        entries = []
+        for i in xrange(bisect.bisect_left(self.ordered, prefix),
+                        len(self.ordered)):
+            if not self.ordered[i].startswith(prefix):
+                break
+            entries.append(self.entries[self.ordered[i]])
+        return self.nearest(entries, start, forwards)
@@ -0,0 +1,69 @@
+import os
+import shutil
+import tempfile
+
+from opscli import history
+
+
+lines = ['show vlan', 'configure terminal', 'show interface 1',
+         'show vlan', 'interface 1', 'show running-config']
+index = history.Index(lines)
+end = len(index)
+
+# The nearest line before a position, or after it
+print index.search('vlan', end) == 3
+print index.search('vlan', 3) == 0
+print index.search('vlan', 0) is None
+print index.search('vlan', 0, forwards=True) == 3
+print index.search('interface 1', end) == 4
+print index.search('nothing', end) is None
+# Terms too short for trigrams
+print index.search('1', end) == 4
+print index.search('te', 2) == 1
+
+print index.search_prefix('show', end) == 5
+print index.search_prefix('show', 5) == 3
+print index.search_prefix('show i', end) == 2
+print index.search_prefix('show', 0, forwards=True) == 2
+print index.search_prefix('interface', 4) is None
+print index.search_prefix('', end) == 5
+
+# Lines appended after searching are indexed too
+index.append('show vlan 2')
+index.append('no shutdown')
+print index.search('vlan', len(index)) == 6
+print index.search_prefix('no', len(index)) == 7
+print index.lines == lines + ['show vlan 2', 'no shutdown']
+
+# Trigrams are saved, and read by the next index
+path = tempfile.mkdtemp()
+try:
+    saved = os.path.join(path, 'history.index')
+    index = history.Index(lines, saved)
+    print index.search('vlan', len(index)) == 3
+    print os.path.exists(saved)
+
+    index = history.Index(lines + ['show vlan 3'], saved)
+    index.build()
+    print index.saved_count == 5
+    print index.search('vlan 3', len(index)) == 6
+    print index.search('running', len(index)) == 5
+
+    # Saved entries that aren't in the lines have no positions
+    index = history.Index(
+        ['no shutdown', 'show vlan', 'interface 1', 'show interface 1'],
+        saved)
+    print index.search('vlan', len(index)) == 1
+    print index.search('running', len(index)) is None
+
+    # and are left out once most of them are
+    index = history.Index(['no shutdown'], saved)
+    index.build()
+    print index.texts == ['no shutdown']
+
+    with open(saved, 'wb') as f:
+        f.write('garbage')
+    index = history.Index(lines, saved)
+    print index.search('vlan', len(index)) == 3
+finally:
+    shutil.rmtree(path)
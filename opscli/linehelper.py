@@ -1,5 +1,7 @@
 import collections
 
+from opscli import pipe
+from opscli.command import context as context_module
 from opscli.command import match
 from opscli.command import parse
 from opscli.command import token
@@ -20,9 +22,58 @@ class CommandParsingError(Error):
     pass
 
 
+# Number of lines to remember the commands of.
+PLAN_CACHE_SIZE = 512
+
+
+class LRUCache(object):
+    """A dictionary that forgets the least recently used items."""
+
+    def __init__(self, size):
+        self.size = size
+        self.items = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self.items)
+
+    def get(self, key, default=None):
+        try:
+            value = self.items.pop(key)
+        except KeyError:
+            return default
+        self.items[key] = value
+        return value
+
+    def put(self, key, value):
+        self.items.pop(key, None)
+        self.items[key] = value
+        while len(self.items) > self.size:
+            self.items.popitem(last=False)
+
+    def clear(self):
+        self.items.clear()
+
+
 class LineHelper(object):
     """Logic glue between CLI logic and Console implementation."""
 
+    def walk(self, words):
+        """Returns the prefix matching walk of the match tree for words.
+
+        Only the words that changed since the last call are matched.
+        """
+        same = 0
+        for old, new in zip(self.walked, words):
+            if old != new:
+                break
+            same += 1
+        del self.walks[same + 1:]
+        del self.walked[same:]
+        for word in words[same:]:
+            self.walks.append(self.walks[-1].advance(word))
+            self.walked.append(word)
+        return self.walks[-1]
+
     def qhelp(self, line):
         pass
 
@@ -32,49 +83,189 @@ class LineHelper(object):
 
 class ContextLineHelper(LineHelper):
 
-    def __init__(self, context, global_context):
+    def __init__(self, context, global_context, trees=None):
+        """trees can be match trees saved from compile() earlier."""
         self.global_context = global_context
+        # The line being typed is parsed and matched word by word, keeping
+        # the work done for the words that were already there.
+        self.parser = parse.Parser()
+        self.walks = []
+        self.walked = []
+        # Commands found for lines by (context tree node, line)
+        self.plans = LRUCache(PLAN_CACHE_SIZE)
+        # Match trees by context tree node, see set_context()
+        self.trees = {}
+        self.saved_trees = trees or {}
+        self.global_tree = self.saved_trees.get(None)
+        if self.global_tree is None:
+            self.global_tree = self.build_tree(global_context, True)
+        # Commands after a pipe are filters, see pipe.py
+        self.filter_tree = pipe.build_tree()
         self.set_context(context)
 
-    def set_context(self, context):
-        commands = list(context) + list(self.global_context)
+    @staticmethod
+    def family(node):
+        """Returns the path to a context tree node from its root."""
+        path = []
+        while node._parent is not None:
+            for name, branch in node._parent._branches.iteritems():
+                if branch is node:
+                    path.append(name)
+                    break
+            node = node._parent
+        return tuple(reversed(path))
+
+    def invalidate(self):
+        """Forget everything derived from the context trees.
+
+        Call this when commands have been registered after the helper was
+        created.
+        """
+        self.plans.clear()
+        self.trees.clear()
+        self.saved_trees = {}
+        self.global_tree = self.build_tree(self.global_context, True)
+        self.set_context(self.context)
+
+    def build_tree(self, context, is_global):
+        """Build a match tree for the commands available in context.
+
+        The values of the match groups are (is_global, words) and are
+        turned into bound commands by bind().
+        """
         tree = match.Tree()
-        for words, obj in commands:
-            # TODO(bluecmd): Register legal modifiers for this command
-            modifiers = {'is_negated': False}
-            bound = obj.bind(**modifiers)
+        for words, obj in context:
             command_tokens = [token.LiteralType(x) for x in words]
-            for option in obj.options:
-                tree.add(match.MatchGroup(command_tokens, option, bound))
-        self.tree = tree
+            grammar = token.compile(obj.options)
+            tree.add(match.MatchGroup(
+                command_tokens, grammar, (is_global, tuple(words))))
+        return tree
+
+    def set_context(self, context):
+        # The commands available only depend on the place in the context
+        # tree, so contexts there share a match tree. Commands are bound to
+        # the current context when they are executed.
+        tree = self.trees.get(context._tree)
+        if tree is None:
+            tree = self.saved_trees.get(self.family(context._tree))
+        if tree is None:
+            tree = self.build_tree(context, False)
+        self.trees[context._tree] = tree
+        self.tree = match.Chain(tree, self.global_tree)
+        self.walks = [self.tree.walk(prefix=True)]
+        self.walked = []
         self.context = context
 
+    def compile(self, root):
+        """Build the match trees for every context family under root.
+
+        Returns the trees by family(), and the global tree by None, to be
+        passed to the constructor of a later helper.
+        """
+        trees = {None: self.global_tree}
+        nodes = [root]
+        while nodes:
+            node = nodes.pop()
+            if node._parent is None or node._is_border_object():
+                tree = self.trees.get(node)
+                if tree is None:
+                    # Contexts can't be created without their arguments,
+                    # but the commands in them can be listed without one.
+                    tree = self.build_tree(
+                        context_module.BoundContextTree(node, None), False)
+                trees[self.family(node)] = tree
+            nodes.extend(node._branches.itervalues())
+        return trees
+
+    def bind(self, value):
+        """Returns the bound command for a match group value."""
+        is_global, words = value
+        obj = self.global_context if is_global else self.context
+        for word in words:
+            obj = getattr(obj, word)
+        # TODO(bluecmd): Register legal modifiers for this command
+        modifiers = {'is_negated': False}
+        return obj.New().bind(**modifiers)
+
     @property
     def prompt(self):
         # TODO(bluecmd): Make nice prompt
         return str(self.context)
 
     def resolve_commands(self, line):
+        """Yields (bound command, options) for each command in the line.
+
+        The commands after the first are pipe filters, yielded as
+        (filter, options). The commands found for a line are cached, see
+        plan().
+        """
+        key = (self.context._tree, line)
+        plans = self.plans.get(key)
+        if plans is None:
+            plans = self.plan(line)
+            self.plans.put(key, plans)
+        return self.bind_plans(plans)
+
+    def resolve_words(self, commands):
+        """Like resolve_commands(), for a line already split into commands
+        of words."""
+        return self.bind_plans(self.plan_commands(commands))
+
+    def bind_plans(self, plans):
+        for i, plan in enumerate(plans):
+            if isinstance(plan, Error):
+                raise plan
+            value, option_tokens, option_words = plan
+            # Step 3) Transform options, for every run of the line
+            options = [token(word)
+                       for word, token in zip(option_words, option_tokens)]
+            if i == 0:
+                yield self.bind(value), options
+            else:
+                yield value(), options
+
+    def plan(self, line):
+        """Returns the match group value, option tokens and option words of
+        each command.
+
+        A command that isn't found is represented by its error, which is
+        raised when resolve_commands() gets to it.
+        """
         # Step 1) Parse command
-        parse_result = parse.parse(line)
+        parse_result = self.parser.parse(line)
         if not parse_result.success:
             raise CommandParsingError(parse_result.error)
+        return self.plan_commands(parse_result.commands)
 
-        for command in parse_result.commands:
+    def plan_commands(self, commands):
+        plans = []
+        tree = self.tree
+        for command in commands:
             # Step 2) Match and bind
-            match_result = next(self.tree.match(command), None)
+            match_result = next(tree.match(command), None)
             if match_result is None:
-                raise CommandNotFoundError(command)
-            bound_command = match_result.value
-            # Remove options that the receiving function will not handle
-            option_tokens = match_result.secondary[:bound_command.argc]
+                plans.append(CommandNotFoundError(command))
+            else:
+                plans.append(self.plan_command(tree, command, match_result))
+            tree = self.filter_tree
+        return plans
+
+    def plan_command(self, tree, command, match_result):
+        """Returns the match group value, option tokens and option words.
 
-            # Step 3) Transform options
-            # Remove primary (command) arguments
-            option_words = command[len(match_result.primary):]
-            options = [token(word) for word, token in zip(option_words, option_tokens)]
+        Options are transformed by bind_plans() rather than here, so
+        transforms aren't skipped, nor their results shared, by lines
+        that are run again.
+        """
+        option_tokens = match_result.secondary
+        if tree is self.tree:
+            argc = self.bind(match_result.value).argc
+            # Remove options that the receiving function will not handle
+            option_tokens = option_tokens[:argc]
 
-            yield bound_command, options
+        # Remove primary (command) arguments
+        option_words = command[len(match_result.primary):]
+        return match_result.value, option_tokens, option_words
 
     def prefix_matched_candidates(self, line):
         """Calculates the prefix matched candidates.
@@ -91,16 +282,27 @@ class ContextLineHelper(LineHelper):
 
         # We need to strip the input here because the command line is not yet
         # complete and may include trailing spaces that are not valid otherwise
-        parse_result = parse.parse(line.strip())
+        line = line.strip()
+        piped = line.endswith('|')
+        if piped:
+            # The filter hasn't been started yet
+            line = line[:-1].rstrip()
+        parse_result = self.parser.parse(line)
         if not parse_result.success:
             raise CommandParsingError(parse_result.error)
+        if piped:
+            return sorted(str(x) for x in self.filter_tree), ''
 
         # Grab the last command, assume the user wants to know about that
         # TODO(bluecmd): We could try to figure out what command the user was
         # located at when typing '?' and give help about that option.
         command = parse_result.commands[-1]
 
-        matches = list(self.tree.match(command, prefix=True))
+        if len(parse_result.commands) > 1:
+            walk = self.filter_tree.walk(prefix=True).extend(command)
+        else:
+            walk = self.walk(command)
+        matches = list(walk.matches())
         if not matches:
             raise CommandNotFoundError(' '.join(command))
 
@@ -0,0 +1,140 @@
+import cPickle
+
+from opscli import linehelper
+from opscli.command import command
+from opscli.command import context
+from opscli.command import token
+
+
+class NumberToken(token.Token):
+    def match(self, word):
+        return word.isdigit()
+
+    def transform(self, word):
+        return int(word)
+
+
+class VlanContext(context.Context):
+    def new(self, vlan):
+        self.vlan = vlan
+
+
+class Vlan(command.Utility):
+    options = token.construct(NumberToken())
+
+    def command(self, vlan_id):
+        return self.context(vlan_id)
+
+
+class Name(command.Utility):
+    def command(self):
+        return 'vlan %d' % self.context._context.vlan
+
+
+class Quit(command.Utility):
+    def command(self):
+        return 'quit'
+
+
+root = context.ContextTree(context.Context)
+root.vlan = VlanContext
+root.vlan = Vlan
+root.vlan.name = Name
+global_root = context.ContextTree(context.Context)
+global_root.quit = Quit
+
+helper = linehelper.ContextLineHelper(root(), global_root())
+
+
+def run(line):
+    bound, options = next(helper.resolve_commands(line))
+    return bound(*options)
+
+vlan10 = run('vlan 10').context
+vlan20 = run('vlan 20').context
+
+# Contexts in the same place share the match tree
+helper.set_context(vlan10)
+tree = helper.tree.trees[0]
+helper.set_context(vlan20)
+print helper.tree.trees[0] is tree
+print len(helper.trees) == 2
+
+# Commands are bound to the current context
+print run('name').value == 'vlan 20'
+helper.set_context(vlan10)
+print run('name').value == 'vlan 10'
+
+# Global commands are available everywhere
+print run('quit').value == 'quit'
+print helper.qhelp('') == ['name', 'quit']
+
+# Match trees can be saved and used by a new helper
+trees = cPickle.loads(cPickle.dumps(helper.compile(root), 2))
+print sorted(trees) == [None, (), ('vlan', )]
+
+
+def no_build(*args):
+    raise AssertionError('Tree built')
+
+saved = linehelper.ContextLineHelper(root(), global_root(), trees)
+saved.build_tree = no_build
+print saved.qhelp('') == ['quit', 'vlan']
+bound, options = next(saved.resolve_commands('vlan 30'))
+saved.set_context(bound(*options).context)
+print saved.qhelp('n') == ['name']
+bound, options = next(saved.resolve_commands('name'))
+print bound(*options).value == 'vlan 30'
+
+# Completion reuses the matching done for the start of the line
+helper.set_context(root())
+print helper.qhelp('vlan ') == ['NumberToken']
+print helper.qhelp('vlan 1') == ['NumberToken']
+print helper.qhelp('q') == ['quit']
+print len(helper.walks) == 2
+
+# Resolved lines are cached but bound to the context they run in
+helper.set_context(vlan20)
+helper.plans.clear()
+print run('name').value == 'vlan 20'
+print len(helper.plans) == 1
+helper.set_context(vlan10)
+print run('name').value == 'vlan 10'
+print len(helper.plans) == 1
+
+# Options are transformed every time a cached line is run
+transformed = []
+transform = NumberToken.transform
+NumberToken.transform = lambda self, word: transformed.append(word) or 1
+helper.set_context(root())
+print next(helper.resolve_commands('vlan 10'))[1] == [1]
+print next(helper.resolve_commands('vlan 10'))[1] == [1]
+print transformed == ['10', '10']
+NumberToken.transform = transform
+helper.set_context(vlan10)
+
+# The cache only keeps the most recently used lines
+cache = linehelper.LRUCache(2)
+cache.put('a', 1)
+cache.put('b', 2)
+cache.get('a')
+cache.put('c', 3)
+print cache.get('b') is None and cache.get('a') == 1 and len(cache) == 2
+
+helper.invalidate()
+print len(helper.plans) == 0
+print run('name').value == 'vlan 10'
+
+# Commands after a pipe are filters
+helper.set_context(root())
+commands = list(helper.resolve_commands('vlan 10 | include x | count'))
+print [type(x).__name__ for x, _ in commands[1:]] == ['Include', 'Count']
+print commands[1][1][0].pattern == 'x'
+print helper.qhelp('vlan 10 | ') == [
+    'begin', 'count', 'exclude', 'include', 'section']
+print helper.complete('vlan 10 | inc') == ['lude']
+try:
+    list(helper.resolve_commands('vlan 10 | vlan 20'))
+    print False
+except linehelper.CommandNotFoundError:
+    print True
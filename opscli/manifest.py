@@ -0,0 +1,433 @@
+"""
+Cached manifest of the commands registered by command modules.
+
+Importing every command module and calling its register() function at
+each shell start gets slow as the number of modules grows. The first time
+a module directory is loaded, this module records what each module
+registered: the paths in the context trees, which of those are context
+families, and for commands their options and argument counts. The
+manifest is saved in the module directory.
+
+On later starts, as long as none of the module files changed, nor the
+code they import, the context trees are filled from the manifest with
+stand-in classes instead of importing the modules. A stand-in command
+carries the options of the real command, which is all that's needed to
+build match trees and complete command lines. The module is imported the
+first time one of its commands is executed, or one of its contexts
+entered.
+
+The match trees built from the context trees (see linehelper.py) can be
+saved as well, so a new shell doesn't need to build any to complete the
+first command. They are only used as long as the manifests of all module
+directories they were built from are unchanged.
+
+A module whose registrations can't be recorded, e.g. because it registers
+a class that isn't reachable by name from its module, is always imported
+and registered the usual way. Modules are expected to do nothing in
+register() besides adding to the trees.
+
+Usage:
+  loaded = manifest.load_commands('commands', root, global_root)
+  loaded['modules'] => records of the modules
+  key = manifest.trees_key([('commands', loaded)])
+  trees = manifest.read_trees('commands', key)
+"""
+import cPickle
+import hashlib
+import logging
+import os
+import sys
+import types
+
+from opscli import collector
+from opscli.command import command
+from opscli.command import context
+
+
+MANIFEST_FILE = '.opscli-manifest'
+TREES_FILE = '.opscli-trees'
+
+# Bump this when the manifest layout changes.
+MANIFEST_VERSION = 2
+
+# Modules the records and the match trees are made with, besides those the
+# command modules import.
+DEPENDENCIES = (
+    'opscli.command.command',
+    'opscli.command.context',
+    'opscli.command.match',
+    'opscli.command.token',
+    'opscli.linehelper',
+)
+
+# Modifiers commands are bound with; argument counts are recorded for each.
+MODIFIERS = (
+    {'is_negated': False},
+    {'is_negated': True},
+)
+
+
+def modifiers_key(modifiers):
+    return tuple(sorted(modifiers.iteritems()))
+
+
+def resolve(module_name, class_name):
+    """Import a module on behalf of a stand-in, and return the class."""
+    if module_name not in sys.modules:
+        logging.info('Loading command module %s', module_name)
+        __import__(module_name)
+    return getattr(sys.modules[module_name], class_name)
+
+
+class LazyContext(context.Context):
+    """Stand-in for a context class registered by a module.
+
+    Instantiating it imports the module and returns an instance of the
+    real context class.
+    """
+
+    target = None
+
+    def __new__(cls, *args, **kwargs):
+        return resolve(*cls.target)(*args, **kwargs)
+
+
+class LazyCommand(command.Command):
+    """Stand-in for a command class registered by a module."""
+
+    target = None
+    # Number of arguments the routed function takes, by modifiers_key().
+    argc = {}
+
+    class Bound(object):
+
+        def __init__(self, command, **kwargs):
+            self.command = command
+            self.modifiers = kwargs
+            key = modifiers_key(kwargs)
+            if key in command.argc:
+                self.argc = command.argc[key]
+            else:
+                self.argc = self.resolve().argc
+
+        def resolve(self):
+            return self.command.resolve().bind(**self.modifiers)
+
+        def __call__(self, *options):
+            return self.resolve()(*options)
+
+        def __str__(self):
+            return str(self.resolve())
+
+    def resolve(self):
+        """Returns an instance of the real command in the same context."""
+        if 'real' not in self.__dict__:
+            self.real = resolve(*self.target)(self.context)
+        return self.real
+
+    def bind(self, **kwargs):
+        return LazyCommand.Bound(self, **kwargs)
+
+    def route(self, **kwargs):
+        return self.resolve().route(**kwargs)
+
+
+class RecordingTree(object):
+    """Wraps a ContextTree passed to register(), noting every assignment."""
+
+    def __init__(self, tree, name, log, path=()):
+        self.__dict__['_tree'] = tree
+        self.__dict__['_name'] = name
+        self.__dict__['_log'] = log
+        self.__dict__['_path'] = path
+
+    def __getattr__(self, name):
+        return RecordingTree(getattr(self._tree, name), self._name,
+                             self._log, self._path + (name,))
+
+    def __setattr__(self, name, value):
+        self._log.append((self._name, self._path + (name,), value))
+        setattr(self._tree, name, value)
+
+
+def describe(tree_name, path, value):
+    """Returns a registration record for value, or None if it can't be
+    registered through a stand-in."""
+    module = sys.modules.get(value.__module__)
+    if getattr(module, value.__name__, None) is not value:
+        return None
+    target = (value.__module__, value.__name__)
+    if issubclass(value, context.Context):
+        return (tree_name, path, 'context', target, None, None)
+    argc = {}
+    try:
+        instance = value(None)
+        for modifiers in MODIFIERS:
+            argc[modifiers_key(modifiers)] = instance.bind(**modifiers).argc
+    except Exception:
+        return None
+    return (tree_name, path, 'command', target, value.options, argc)
+
+
+def import_module(name, root, global_root):
+    """Import and register a module the usual way, and return its record."""
+    module = __import__(name)
+    log = []
+    if hasattr(module, 'register'):
+        module.register(RecordingTree(root, 'root', log),
+                        RecordingTree(global_root, 'global', log))
+    record = {
+        'name': name,
+        'tables': getattr(module, 'OVSDB_TABLES', None),
+        'lazy': True,
+        'registrations': [],
+    }
+    for tree_name, path, value in log:
+        registration = describe(tree_name, path, value)
+        try:
+            cPickle.dumps(registration, cPickle.HIGHEST_PROTOCOL)
+        except Exception:
+            registration = None
+        if registration is None:
+            logging.info('Module %s will not be loaded lazily', name)
+            record['lazy'] = False
+            record['registrations'] = []
+            break
+        record['registrations'].append(registration)
+    return record
+
+
+def register(record, root, global_root, stand_ins):
+    """Fill the trees with stand-ins for the classes in a module record.
+
+    stand_ins is shared between records, so a class registered in several
+    places is represented by the same stand-in.
+    """
+    if not record['lazy']:
+        module = __import__(record['name'])
+        if hasattr(module, 'register'):
+            module.register(root, global_root)
+        return
+
+    trees = {'root': root, 'global': global_root}
+    registrations = record['registrations']
+    for tree_name, path, kind, target, options, argc in registrations:
+        if target not in stand_ins:
+            if kind == 'context':
+                attributes = {'target': target}
+                base = LazyContext
+            else:
+                attributes = {'target': target, 'options': options,
+                              'argc': argc}
+                base = LazyCommand
+            stand_ins[target] = type(target[1], (base,), attributes)
+        tree = trees[tree_name]
+        for word in path[:-1]:
+            tree = getattr(tree, word)
+        setattr(tree, path[-1], stand_ins[target])
+
+
+def module_files(path):
+    filenames = []
+    for filename in sorted(os.listdir(path)):
+        if not filename.endswith('.py') or filename.endswith('_test.py'):
+            continue
+        filenames.append(filename)
+    return filenames
+
+
+def file_signature(filename):
+    stat = os.stat(filename)
+    return (stat.st_mtime, stat.st_size)
+
+
+def file_hash(filename):
+    with open(filename, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def fingerprint(filename):
+    return (file_signature(filename), file_hash(filename))
+
+
+def unchanged(filename, saved):
+    """Returns if a file still has the fingerprint() saved for it."""
+    try:
+        if file_signature(filename) == saved[0]:
+            return True
+        # Touched, but maybe not changed.
+        return file_hash(filename) == saved[1]
+    except (IOError, OSError):
+        return False
+
+
+def dependencies(modules, imported):
+    """Returns the source files the records of modules depend on.
+
+    Those are the files of DEPENDENCIES, of the modules imported since
+    sys.modules had the names in imported, and of the modules that
+    modules import from, even if they were imported before.
+    """
+    names = set(DEPENDENCIES)
+    names.update(name for name in list(sys.modules) if name not in imported)
+    for module in modules:
+        for value in vars(sys.modules[module]).itervalues():
+            if isinstance(value, types.ModuleType):
+                names.add(value.__name__)
+            else:
+                name = getattr(value, '__module__', None)
+                if isinstance(name, basestring):
+                    names.add(name)
+    filenames = set()
+    for name in names:
+        if name in DEPENDENCIES:
+            __import__(name)
+        filename = getattr(sys.modules.get(name), '__file__', None)
+        if filename is None:
+            # Built in, or not a module
+            continue
+        filename = os.path.abspath(filename)
+        if filename.endswith(('.pyc', '.pyo')) and os.path.exists(
+                filename[:-1]):
+            filename = filename[:-1]
+        filenames.add(filename)
+    return sorted(filenames)
+
+
+def load(f):
+    with collector.paused():
+        return cPickle.load(f)
+
+
+def loads(data):
+    with collector.paused():
+        return cPickle.loads(data)
+
+
+def read(path, filenames):
+    """Returns the saved manifest for path, if it is still valid."""
+    manifest_file = os.path.join(path, MANIFEST_FILE)
+    try:
+        with open(manifest_file, 'rb') as f:
+            manifest = load(f)
+    except Exception:
+        # Missing, unreadable, or refers to classes that no longer exist.
+        return None
+    if manifest.get('version') != MANIFEST_VERSION:
+        return None
+    files = manifest['files']
+    if sorted(files) != filenames:
+        return None
+    for filename in filenames:
+        if not unchanged(os.path.join(path, filename), files[filename]):
+            return None
+    for filename, saved in manifest['dependencies'].iteritems():
+        if not unchanged(filename, saved):
+            return None
+    return manifest
+
+
+def save(filename, *objects):
+    """Pickle objects to a file, replacing it atomically."""
+    try:
+        with open(filename + '.tmp', 'wb') as f:
+            for obj in objects:
+                cPickle.dump(obj, f, cPickle.HIGHEST_PROTOCOL)
+        os.rename(filename + '.tmp', filename)
+    except (IOError, OSError):
+        logging.info('Could not save %s', filename)
+
+
+def write(path, filenames, records, imported):
+    """imported are the names in sys.modules before the modules were
+    imported to make the records, see dependencies()."""
+    files = {}
+    for filename in filenames:
+        files[filename] = fingerprint(os.path.join(path, filename))
+    depends = {}
+    modules = [filename[:-3] for filename in filenames]
+    for filename in dependencies(modules, imported):
+        # The modules in path are already in files
+        if os.path.dirname(filename) != os.path.abspath(path):
+            depends[filename] = fingerprint(filename)
+    manifest = {
+        'version': MANIFEST_VERSION,
+        'files': files,
+        'dependencies': depends,
+        'modules': records,
+    }
+    save(os.path.join(path, MANIFEST_FILE), manifest)
+    return manifest
+
+
+def load_commands(path, root, global_root):
+    """Register the commands of all modules in path into the trees.
+
+    Returns the manifest of the directory. Its 'modules' are the records
+    of the modules, which include the OVSDB tables each module declared.
+    """
+    filenames = module_files(path)
+    manifest = read(path, filenames)
+    if manifest is None:
+        imported = set(sys.modules)
+        records = []
+        for filename in filenames:
+            records.append(import_module(filename[:-3], root, global_root))
+        return write(path, filenames, records, imported)
+
+    stand_ins = {}
+    for record in manifest['modules']:
+        register(record, root, global_root, stand_ins)
+    return manifest
+
+
+def trees_key(manifests):
+    """Returns what saved match trees depend on.
+
+    manifests is a list of (path, manifest) for every module directory
+    loaded, in order.
+    """
+    return (MANIFEST_VERSION,
+            [(path, manifest['files'], manifest['dependencies'])
+             for path, manifest in manifests])
+
+
+class SavedTrees(object):
+    """Match trees by family, each unpickled the first time it is needed."""
+
+    def __init__(self, pickled):
+        self.pickled = pickled
+        self.trees = {}
+
+    def get(self, family, default=None):
+        if family not in self.trees:
+            pickled = self.pickled.pop(family, None)
+            if pickled is None:
+                # Unknown, or being unpickled for another session
+                return self.trees.get(family, default)
+            self.trees[family] = loads(pickled)
+        return self.trees[family]
+
+
+def read_trees(path, key):
+    """Returns the match trees saved in path, if they are for key."""
+    try:
+        with open(os.path.join(path, TREES_FILE), 'rb') as f:
+            if load(f) != key:
+                return None
+            return SavedTrees(load(f))
+    except Exception:
+        return None
+
+
+def write_trees(path, key, trees):
+    """Save match trees by family, as returned by linehelper's compile()."""
+    pickled = {}
+    for family, tree in trees.iteritems():
+        try:
+            pickled[family] = cPickle.dumps(tree, cPickle.HIGHEST_PROTOCOL)
+        except Exception:
+            # e.g. a token that keeps a lambda; the tree is built again
+            # when it is needed.
+            logging.info('Not saving the match tree of %r', family)
+    save(os.path.join(path, TREES_FILE), key, pickled)
@@ -0,0 +1,149 @@
+import os
+import sys
+
+from opscli import manifest
+from opscli import testing
+from opscli.command import context
+from opscli.command import token
+
+
+MODULE = '''
+from opscli.command import command
+from opscli.command import context
+from opscli.command import token
+
+import manifest_helper
+
+OVSDB_TABLES = {'Port': ['name']}
+
+
+class PortContext(context.Context):
+
+    def new(self, name):
+        self.prompt = 'port-' + name
+
+
+class Port(command.Utility):
+    options = token.InOrder(token.LiteralType(manifest_helper.PORT))
+
+    def command(self, name):
+        return self.context(name)
+
+
+class Description(command.Feature):
+    options = token.InOrder(token.LiteralType('x'))
+
+    def activate(self, text):
+        return 'description %s' % text
+
+    def deactivate(self):
+        return 'no description'
+
+
+def register(root, everywhere):
+    root.port = PortContext
+    root.port = Port
+    root.port.description = Description
+'''
+
+# Code the module imports from elsewhere
+HELPER = '''
+PORT = %r
+'''
+
+# Changed sources are read again within the same second
+sys.dont_write_bytecode = True
+
+
+def load():
+    root = context.ContextTree(context.Context)
+    global_root = context.ContextTree(context.Context)
+    loaded = manifest.load_commands(path, root, global_root)
+    return root, loaded['modules']
+
+
+with testing.directory(manifest_module=MODULE) as path:
+    helper_path = os.path.join(path, 'lib')
+    os.mkdir(helper_path)
+    with open(os.path.join(helper_path, 'manifest_helper.py'), 'w') as f:
+        f.write(HELPER % 'eth1')
+    sys.path[:0] = [path, helper_path]
+
+    # First load imports the module and saves the manifest
+    root, records = load()
+    print 'manifest_module' in sys.modules
+    print os.path.exists(os.path.join(path, manifest.MANIFEST_FILE))
+    print records[0]['lazy']
+    print records[0]['tables'] == {'Port': ['name']}
+    del sys.modules['manifest_module']
+
+    # Second load registers stand-ins without importing
+    root, records = load()
+    print 'manifest_module' not in sys.modules
+    print records[0]['tables'] == {'Port': ['name']}
+    commands = dict((tuple(w), obj) for w, obj in root())
+    port = commands[('port',)]
+    print issubclass(root.port._bind, manifest.LazyCommand)
+    print str(port.options) == str(token.InOrder(token.LiteralType('eth1')))
+    print port.bind(is_negated=False).argc == 2
+    print 'manifest_module' not in sys.modules
+
+    # Running a command imports the module
+    ret = port.bind(is_negated=False)('eth1')
+    print 'manifest_module' in sys.modules
+    print str(ret.context) == 'port-eth1'
+    description = dict(
+        (tuple(w), obj) for w, obj in ret.context)[('description',)]
+    print description(is_negated=True).value == 'no description'
+    print description('x', is_negated=False).value == 'description x'
+
+    # Saved match trees are only used with the same manifests
+    loaded = manifest.load_commands(path, root, context.ContextTree())
+    key = manifest.trees_key([(path, loaded)])
+    manifest.write_trees(path, key, {None: 'trees'})
+    print manifest.read_trees(path, key).get(None) == 'trees'
+    print manifest.read_trees(path, manifest.trees_key([])) is None
+
+    # Trees that can't be pickled are left out, and built when needed
+    class Checked(token.LiteralType):
+        def __init__(self, string, check):
+            token.LiteralType.__init__(self, string)
+            self.check = check
+
+        def match(self, word):
+            return self.check(word)
+
+    checked = Checked('x', lambda word: word == 'x')
+    trees = {None: 'trees', ('port',): token.InOrder(checked)}
+    manifest.write_trees(path, key, trees)
+    saved = manifest.read_trees(path, key)
+    print saved.get(None) == 'trees'
+    print saved.get(('port',)) is None
+
+    # Changing a module invalidates the manifest
+    del sys.modules['manifest_module']
+    with open(os.path.join(path, 'manifest_module.py'), 'a') as f:
+        f.write('\n# changed\n')
+    root, records = load()
+    print 'manifest_module' in sys.modules
+    loaded = manifest.load_commands(path, root, context.ContextTree())
+    key = manifest.trees_key([(path, loaded)])
+    print manifest.read_trees(path, key) is None
+    manifest.write_trees(path, key, {None: 'trees'})
+
+    # and so does changing the code it imports, here or in opscli
+    dependencies = loaded['dependencies']
+    print os.path.join(helper_path, 'manifest_helper.py') in dependencies
+    print os.path.abspath(token.__file__).rstrip('c') in dependencies
+    print os.path.join(path, 'manifest_module.py') not in dependencies
+    del sys.modules['manifest_module']
+    del sys.modules['manifest_helper']
+    with open(os.path.join(helper_path, 'manifest_helper.py'), 'w') as f:
+        f.write(HELPER % 'eth10')
+    root, records = load()
+    print 'manifest_module' in sys.modules
+    port = dict((tuple(w), obj) for w, obj in root())[('port',)]
+    print str(port.options) == str(token.InOrder(token.LiteralType('eth10')))
+    loaded = manifest.load_commands(path, root, context.ContextTree())
+    print manifest.read_trees(
+        path, manifest.trees_key([(path, loaded)])) is None
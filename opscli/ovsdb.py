@@ -13,20 +13,230 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+import collections
+import itertools
 import json
 import logging
+import re
 import select
 import socket
+import threading
+import time
+
+from opscli import ovsdb_query
 
 
 DEFAULT_DB = 'OpenSwitch'
-OVSDB_TIMEOUT_MS = 1000
 
+# How long to wait for the reply to a request.
+OVSDB_TIMEOUT_MS = 5000
+
+
+class Error(Exception):
+    """Base error class for this module."""
+    pass
+
+
+class ConnectionClosedError(Error):
+    """The server closed the connection on us."""
+    pass
+
+
+class TimeoutError(Error):
+    """The server didn't reply in time."""
+    pass
+
+
+class CancelledError(Error):
+    """The request was cancelled before its reply arrived."""
+    pass
+
+
+class ProtocolError(Error):
+    """The server sent something that isn't a JSON-RPC message."""
+    pass
+
+
+class JsonStream(object):
+    """Splits the byte stream from the server into JSON-RPC messages.
+
+    Messages are JSON objects sent back to back without any delimiter.
+    Rather than trying to decode the whole buffer after every chunk, the
+    stream tracks brace depth and string state as chunks arrive. Every byte
+    is scanned once, and every message is decoded once, when its closing
+    brace shows up. Bytes following a complete message are kept for the
+    next one.
+    """
+
+    # Characters that can change the scanner state.
+    OBJECT_SPECIAL = re.compile(r'[{}"]')
+    STRING_SPECIAL = re.compile(r'["\\]')
+    NON_WHITESPACE = re.compile(r'\S')
+
+    def __init__(self):
+        # Parts of a message that is spread over several chunks.
+        self.pieces = []
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+
+    def feed(self, data):
+        """Scan a chunk of data, and return the messages it completed."""
+        messages = []
+        start = 0
+        pos = 0
+        end = len(data)
+        while pos < end:
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                    pos += 1
+                    continue
+                m = self.STRING_SPECIAL.search(data, pos)
+                if m is None:
+                    break
+                pos = m.end()
+                if m.group() == '\\':
+                    self.escaped = True
+                else:
+                    self.in_string = False
+                continue
+
+            if self.depth == 0:
+                # Between messages: skip whitespace up to the next one.
+                m = self.NON_WHITESPACE.search(data, pos)
+                if m is None:
+                    pos = end
+                    break
+                if m.group() != '{':
+                    raise ProtocolError(
+                            'Unexpected data: %r' % data[m.start():])
+                start = pos = m.start()
+
+            m = self.OBJECT_SPECIAL.search(data, pos)
+            if m is None:
+                break
+            pos = m.end()
+            char = m.group()
+            if char == '"':
+                self.in_string = True
+            elif char == '{':
+                self.depth += 1
+            else:
+                self.depth -= 1
+                if self.depth == 0:
+                    self.pieces.append(data[start:pos])
+                    messages.append(json.loads(''.join(self.pieces)))
+                    self.pieces = []
+                    start = pos
+
+        if self.depth > 0:
+            self.pieces.append(data[start:])
+        return messages
+
+
+class Reply(object):
+    """The future reply to a request sent on a Connection.
+
+    result() waits for the reply to arrive, processing any other messages
+    that come in before it. If unpack is given, result() returns
+    unpack(response) rather than the raw response.
+
+    Instead of waiting, callers that run their own poll loop on the
+    connection can register a callback with add_done_callback().
+    """
+
+    def __init__(self, connection, request_id, unpack=None):
+        self.connection = connection
+        self.id = request_id
+        self.unpack = unpack
+        self.response = None
+        self.error = None
+        self.callbacks = []
+
+    def done(self):
+        return self.response is not None or self.error is not None
+
+    def set_response(self, response):
+        self.response = response
+        self.run_callbacks()
+
+    def set_error(self, error):
+        self.error = error
+        self.run_callbacks()
+
+    def add_done_callback(self, callback):
+        """Call callback(reply) once the reply is in."""
+        if self.done():
+            callback(self)
+        else:
+            self.callbacks.append(callback)
+
+    def run_callbacks(self):
+        callbacks, self.callbacks = self.callbacks, []
+        for callback in callbacks:
+            callback(self)
+
+    def cancel(self):
+        """Stop waiting for the reply, and ask the server to abandon the
+        request. A transaction the server already committed stays
+        committed."""
+        if self.done():
+            return
+        self.connection.cancel(self)
+        self.set_error(CancelledError('Request %s cancelled' % self.id))
+
+    def result(self, timeout=None):
+        """Wait up to timeout seconds (forever if None) for the reply.
+
+        Raises TimeoutError if it doesn't arrive in time; the request stays
+        outstanding, so the caller may wait again or cancel() it. If the
+        wait is interrupted by ^C, the request is cancelled.
+        """
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+        try:
+            while not self.done():
+                remaining = None
+                if deadline is not None:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        raise TimeoutError('No reply to request %s' % self.id)
+                self.connection.process(self, remaining)
+        except KeyboardInterrupt:
+            self.cancel()
+            raise
+        if self.error is not None:
+            raise self.error
+        if self.unpack is not None:
+            return self.unpack(self.response)
+        return self.response
+
+
+class Connection(object):
+    """A single JSON-RPC socket to the OVSDB server.
+
+    Any number of requests can be in flight at once. Replies are matched to
+    their requests by id, in whatever order they arrive.
+    """
 
-class Ovsdb:
     def __init__(self, server):
         self.server = server
-        self.seq = 0
+        self.socket = None
+        self.stream = JsonStream()
+        # Messages that arrived in the same chunk as an earlier one.
+        self.messages = collections.deque()
+        self.ids = itertools.count(1)
+        # Replies that haven't arrived yet, by request id.
+        self.pending = {}
+        # Ids of requests we no longer want the reply to.
+        self.cancelled = set()
+        # Callbacks for notifications from the server, by method name.
+        self.handlers = {}
+        self.send_lock = threading.Lock()
+        self.receive_lock = threading.Lock()
+        self.connect()
 
     def connect(self):
         parts = self.server.split(':')
@@ -53,40 +263,442 @@ class Ovsdb:
         logging.info("Connected.")
 
     def close(self):
+        if self.socket is None:
+            return
         self.socket.close()
+        self.socket = None
         logging.info("Closed connection.")
+        pending, self.pending = self.pending, {}
+        for reply in pending.itervalues():
+            reply.set_error(ConnectionClosedError("Connection closed"))
+
+    def fileno(self):
+        return self.socket.fileno()
+
+    def readable(self):
+        if self.messages:
+            return True
+        p = select.poll()
+        p.register(self.socket, select.POLLIN)
+        return bool(p.poll(0))
+
+    def is_alive(self):
+        """Check that the connection can still be used.
+
+        Whatever the server sent while we weren't looking, such as echo
+        requests, is processed first. That is also how we find out the
+        server hung up on us.
+        """
+        try:
+            self.poll()
+        except Error:
+            self.close()
+        return self.socket is not None
+
+    def poll(self):
+        """Process whatever the server sent, without waiting for more."""
+        while self.socket is not None and self.readable():
+            self.process(timeout=0)
 
     def send(self, msg):
         logging.info("Sending %s" % msg)
-        self.socket.send(json.dumps(msg))
-
-    def receive(self):
-        results = {}
+        try:
+            self.socket.sendall(json.dumps(msg))
+        except socket.error as e:
+            raise ConnectionClosedError(str(e))
+
+    def receive(self, timeout=None):
+        """Returns the next message, or None if none arrived within timeout
+        seconds. With no timeout, waits until one arrives."""
+        if self.messages:
+            return self.messages.popleft()
         p = select.poll()
         p.register(self.socket, select.POLLIN)
-        data = ''
-        while True:
-            fdlist = p.poll(OVSDB_TIMEOUT_MS)
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+        while not self.messages:
+            if deadline is None:
+                fdlist = p.poll()
+            else:
+                fdlist = p.poll(max(0, int((deadline - time.time()) * 1000)))
             if not fdlist:
                 # Timeout.
-                break
+                return None
             if fdlist[0][1] & select.POLLERR:
-                raise Exception("poll error")
+                raise ConnectionClosedError("poll error")
             chunk = self.socket.recv(4096)
             logging.info("Received %d bytes." % len(chunk))
             logging.info(chunk)
             if len(chunk) == 0:
-                raise Exception
-            data += chunk
+                raise ConnectionClosedError("Connection closed by server")
+            self.messages.extend(self.stream.feed(chunk))
+        return self.messages.popleft()
+
+    def request(self, msg, unpack=None):
+        """Send a request, and return its Reply without waiting for it."""
+        with self.send_lock:
+            msg['id'] = next(self.ids)
+            reply = Reply(self, msg['id'], unpack)
+            self.pending[msg['id']] = reply
             try:
-                results = json.loads(data)
-                # If we made it here, we have a valid JSON block.
-                break
-            except Exception:
-                # Didn't parse, incomplete.
-                pass
+                self.send(msg)
+            except ConnectionClosedError:
+                self.close()
+                raise
+        return reply
+
+    def cancel(self, reply):
+        if self.pending.pop(reply.id, None) is None:
+            return
+        # The server still answers the cancelled request, with an error.
+        self.cancelled.add(reply.id)
+        with self.send_lock:
+            try:
+                self.send({'id': None, 'method': 'cancel',
+                           'params': [reply.id]})
+            except ConnectionClosedError:
+                self.close()
+
+    def process(self, reply=None, timeout=None):
+        """Wait up to timeout seconds for one message from the server, and
+        dispatch it.
+
+        If reply is given and already done by the time we get to read, there
+        is nothing to wait for.
+        """
+        with self.receive_lock:
+            if reply is not None and reply.done():
+                return
+            try:
+                msg = self.receive(timeout)
+            except Error:
+                self.close()
+                raise
+            if msg is not None:
+                self.dispatch(msg)
+
+    def dispatch(self, msg):
+        if msg.get('method') == 'echo':
+            # Keepalive from the server.
+            with self.send_lock:
+                self.send({'id': msg['id'], 'result': msg['params'],
+                           'error': None})
+        elif 'method' in msg:
+            handler = self.handlers.get(msg['method'])
+            if handler is None:
+                logging.info("Ignoring %s notification" % msg['method'])
+            else:
+                handler(*msg['params'])
+        elif msg.get('id') in self.pending:
+            self.pending.pop(msg['id']).set_response(msg)
+        elif msg.get('id') in self.cancelled:
+            self.cancelled.remove(msg['id'])
+        else:
+            logging.warn(
+                    "Dropping reply to unknown request %s" % msg.get('id'))
+
+
+class Replica(object):
+    """A local copy of some OVSDB tables, kept current by a monitor.
+
+    tables maps each table name to the list of columns to replicate, or
+    None for all columns. The monitor is set up on the connection the
+    Ovsdb object pipelines its requests on; update notifications are
+    applied whenever that connection gets processed.
+
+    Until the initial table contents have arrived, and while the monitor
+    is being set up again after a reconnect, the replica can't answer and
+    reads go to the server.
+    """
+
+    MONITOR_ID = 'opscli'
+
+    def __init__(self, ovsdb, tables, database=DEFAULT_DB):
+        self.ovsdb = ovsdb
+        self.tables = tables
+        self.database = database
+        self.conn = None
+        self.data = {}
+        # Reply to the monitor request, until it has been applied.
+        self.initial = None
+        # Set once the initial contents are applied; updates that arrive
+        # before that are queued.
+        self.ready = False
+        self.queued = []
+        # Transactions we sent, and how many of them the replica is known
+        # to have seen the updates of.
+        self.writes = 0
+        self.synced = 0
+        # Held while the rows are read or changed, and never while waiting
+        # on the connection: updates are applied by whichever thread is
+        # processing it, which holds the connection's receive lock.
+        self.lock = threading.Lock()
+
+    def subscribe(self, conn):
+        """Set up the monitor on conn, unless it already has one."""
+        if conn is self.conn:
+            return
+        data = {}
+        requests = {}
+        for table, columns in self.tables.iteritems():
+            indexes = []
+            for column in ovsdb_query.INDEXES.get(table, ()):
+                if columns is None or column in columns:
+                    indexes.append(column)
+            data[table] = ovsdb_query.Table(indexes)
+            request = {}
+            if columns is not None:
+                request['columns'] = columns
+            requests[table] = request
+        with self.lock:
+            if conn is self.conn:
+                return
+            self.conn = conn
+            self.data = data
+            self.initial = None
+            self.ready = False
+            self.queued = []
+            self.synced = self.writes
+        conn.handlers['update'] = self.update
+        initial = conn.request({
+            'method': 'monitor',
+            'params': [self.database, self.MONITOR_ID, requests],
+        })
+        with self.lock:
+            if conn is self.conn:
+                self.initial = initial
+
+    def update(self, monitor_id, table_updates):
+        if monitor_id != self.MONITOR_ID:
+            return
+        with self.lock:
+            if not self.ready:
+                self.queued.append(table_updates)
+                return
+            self.apply(table_updates)
+
+    def apply(self, table_updates):
+        """Change the rows. The caller holds self.lock."""
+        for table, row_updates in table_updates.iteritems():
+            rows = self.data[table]
+            for uuid, row_update in row_updates.iteritems():
+                if 'new' in row_update:
+                    rows.update(uuid, row_update['new'])
+                else:
+                    rows.delete(uuid)
+
+    def written(self):
+        """Note that a transaction was sent, so reads wait for its
+        updates."""
+        with self.lock:
+            self.writes += 1
+
+    def sync(self):
+        """Bring the replica up to date. Returns whether it can answer."""
+        # Getting the connection processes anything received since the
+        # last call, including our update notifications.
+        conn = self.ovsdb.connection()
+        self.subscribe(conn)
+        with self.lock:
+            if not self.ready:
+                initial = self.initial
+                if initial is None or not initial.done():
+                    return False
+                self.initial = None
+                response = initial.result()
+                if response['error'] is not None:
+                    raise Exception(response['error'])
+                self.apply(response['result'])
+                for table_updates in self.queued:
+                    self.apply(table_updates)
+                self.queued = []
+                self.ready = True
+            writes = self.writes
+            if self.synced >= writes:
+                return True
+        # The server sends the updates caused by our own transactions
+        # before replying to requests we send after them, so one round
+        # trip is enough to see our own writes.
+        reply = conn.request({'method': 'echo', 'params': []})
+        self.ovsdb.wait(reply)
+        with self.lock:
+            self.synced = max(self.synced, writes)
+        return True
+
+    def covers(self, table, columns, conditions=()):
+        if table not in self.tables:
+            return False
+        replicated = self.tables[table]
+        if replicated is None:
+            return True
+        if columns is None:
+            return False
+        needed = list(columns)
+        for condition in conditions:
+            if condition[0] != '_uuid':
+                needed.append(condition[0])
+        for column in needed:
+            if column not in replicated:
+                return False
+        return True
+
+    def get(self, table, columns=None, conditions=()):
+        results = []
+        with self.lock:
+            for uuid, row in self.data[table].select(conditions):
+                if columns is None:
+                    result = dict(row)
+                    result['_uuid'] = ['uuid', uuid]
+                else:
+                    result = {}
+                    for column in columns:
+                        result[column] = row[column]
+                results.append(result)
         return results
 
+
+class Transaction(object):
+    """Collects operations to commit as one OVSDB transaction.
+
+    Used as a context manager, the transaction is committed when the block
+    ends without an exception:
+
+      with ovsdb.transaction() as txn:
+          txn.map_set_key('System', 'other_config', 'lldp_hold', '4')
+          txn.map_delete_key('System', 'other_config', 'lldp_mgmt_addr')
+
+    Otherwise call commit() when done. Either way all operations go to the
+    server in a single request, which applies all of them or none.
+
+    Each operation method returns the position of that operation's result
+    in results, which is filled in by commit().
+    """
+
+    def __init__(self, ovsdb, database=DEFAULT_DB):
+        self.ovsdb = ovsdb
+        self.database = database
+        self.operations = []
+        self.results = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, unused_value, unused_traceback):
+        if exc_type is None:
+            self.commit()
+
+    def add(self, operation):
+        self.operations.append(operation)
+        return len(self.operations) - 1
+
+    def insert(self, table, row):
+        return self.add(self.ovsdb._insert(table, row))
+
+    def update(self, table, row, conditions=[]):
+        return self.add(self.ovsdb._update(table, row, conditions))
+
+    def mutate_map(self, table, mutations, conditions=[]):
+        return self.add(self.ovsdb._mutate(table, mutations, conditions))
+
+    def map_set_key(self, table, column, key, value, conditions=[]):
+        mutations = [
+            [column, 'delete', ['set', [key]]],
+            [column, 'insert', ['map', [[key, value]]]],
+        ]
+        return self.mutate_map(table, mutations, conditions)
+
+    def map_delete_key(self, table, column, key, conditions=[]):
+        mutations = [
+            [column, 'delete', ['set', [key]]],
+        ]
+        return self.mutate_map(table, mutations, conditions)
+
+    def commit(self):
+        if self.operations:
+            reply = self.ovsdb.transact_async(self.operations, self.database)
+            self.results = self.ovsdb.wait(reply)
+        else:
+            self.results = []
+        return self.results
+
+
+class Ovsdb:
+    def __init__(self, server, timeout=OVSDB_TIMEOUT_MS / 1000.0):
+        self.server = server
+        # Seconds to wait for each reply in the blocking calls.
+        self.timeout = timeout
+        # The connection all requests are pipelined on.
+        self.conn = None
+        self.lock = threading.Lock()
+        self.replica = None
+
+    def connection(self):
+        with self.lock:
+            if self.conn is not None and not self.conn.is_alive():
+                self.conn = None
+            if self.conn is None:
+                self.conn = Connection(self.server)
+            return self.conn
+
+    def connect(self):
+        """Open a connection up front, so the first call doesn't have to."""
+        self.connection()
+
+    def fileno(self):
+        """The socket to watch when driving requests from a poll loop.
+
+        Call poll() when it becomes readable, to dispatch replies to their
+        callbacks and apply replica updates.
+        """
+        return self.connection().fileno()
+
+    def poll(self):
+        self.connection().poll()
+
+    def close(self):
+        with self.lock:
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
+
+    def replicate(self, tables, database=DEFAULT_DB):
+        """Answer reads of the given tables from a local replica.
+
+        tables maps table names to the columns to replicate, or None for
+        all columns. The replica fills in the background; reads go to the
+        server until it is ready.
+        """
+        self.replica = Replica(self, tables, database)
+        self.replica.sync()
+
+    def request(self, msg, unpack=None):
+        """Send a request, and return its Reply without waiting for it.
+
+        A request that could not be sent on a reused connection is retried
+        once on a fresh one. Once a request has gone out it is never resent,
+        since the server may already have acted on it.
+        """
+        for attempt in range(2):
+            conn = self.connection()
+            try:
+                return conn.request(msg, unpack)
+            except ConnectionClosedError:
+                if attempt:
+                    raise
+
+    def wait(self, reply):
+        """Returns the result of reply, for the blocking calls.
+
+        A request whose reply doesn't arrive within self.timeout is
+        cancelled, so the reply isn't kept waiting for forever.
+        """
+        try:
+            return reply.result(self.timeout)
+        except TimeoutError:
+            reply.cancel()
+            raise
+
     def _select(self, table, columns=None, conditions=[]):
         select = {
             "op": "select",
@@ -107,7 +719,7 @@ class Ovsdb:
 
     def _update(self, table, row, conditions=[]):
         update = {
-            "op": "insert",
+            "op": "update",
             "table": table,
             "where": conditions,
             "row": row,
@@ -123,51 +735,65 @@ class Ovsdb:
         }
         return mutate
 
-    def _transact(self, database, seq, operations):
+    def _transact(self, database, operations):
         transact = {
             "method": "transact",
-            "params": [database, operations],
-            "id": seq
+            "params": [database] + list(operations),
         }
         return transact
 
-    def transact(self, transaction, database=DEFAULT_DB):
-        self.seq += 1
-        tmp = self._transact(database, self.seq, transaction)
-        self.send(tmp)
-        while True:
-            response = self.receive()
-            if response.get('id') == self.seq:
-                break
+    def _results(self, response):
         if response['error'] is not None:
             raise Exception(response['error'])
-        elif 'error' in response['result'][0]:
-            raise Exception(response['result'][0])
-        return response['result'][0]
+        for result in response['result']:
+            if result is not None and 'error' in result:
+                raise Exception(result)
+        return response['result']
+
+    def _rows(self, response):
+        return self._results(response)[0]['rows']
+
+    def transaction(self, database=DEFAULT_DB):
+        return Transaction(self, database)
+
+    def transact_async(self, operations, database=DEFAULT_DB):
+        """Start a transaction of one or more operations, and return its
+        Reply without waiting for it. The result is a list with the
+        result of each operation."""
+        tr = self._transact(database, operations)
+        reply = self.request(tr, self._results)
+        if self.replica is not None:
+            self.replica.written()
+        return reply
 
-    def query(self, table, columns=None, conditions=[], database=DEFAULT_DB):
-        self.seq += 1
+    def transact(self, transaction, database=DEFAULT_DB):
+        reply = self.transact_async([transaction], database)
+        return self.wait(reply)[0]
+
+    def query_async(self, table, columns=None, conditions=[],
+                    database=DEFAULT_DB):
+        """Start a select, and return its Reply without waiting for it.
+
+        Any number of queries can be started before collecting the results,
+        which then costs about a single round trip to the server.
+        """
         select = self._select(table, columns, conditions)
-        transact = self._transact(database, self.seq, select)
-        self.send(transact)
-        while True:
-            response = self.receive()
-            if response.get('id') == self.seq:
-                break
-        if response['error'] is not None:
-            raise Exception(response['error'])
-        elif 'error' in response['result'][0]:
-            raise Exception(response['result'][0])
-        return response['result'][0]['rows']
+        tr = self._transact(database, [select])
+        return self.request(tr, self._rows)
 
+    def query(self, table, columns=None, conditions=[], database=DEFAULT_DB):
+        reply = self.query_async(table, columns, conditions, database)
+        return self.wait(reply)
 
-    def get(self, table, columns=None, conditions=[], database=DEFAULT_DB):
-        self.connect()
-        response = self.query(table=table, columns=columns,
-                                conditions=conditions, database=database)
-        self.close()
 
-        return response
+    def get(self, table, columns=None, conditions=[], database=DEFAULT_DB):
+        replica = self.replica
+        if (replica is not None and database == replica.database and
+                replica.covers(table, columns, conditions) and
+                replica.sync()):
+            return replica.get(table, columns, conditions)
+        return self.query(table=table, columns=columns,
+                          conditions=conditions, database=database)
 
 
     def get_map(self, table, column, conditions=[]):
@@ -180,52 +806,30 @@ class Ovsdb:
 
 
     def insert(self, table, row, database=DEFAULT_DB):
-        self.connect()
-        tr = self._insert(table, row)
-        response = self.transact(tr, database=database)
-        self.close()
-
-        return response
+        with self.transaction(database) as txn:
+            txn.insert(table, row)
+        return txn.results[0]
 
 
     def update(self, table, row, conditions=[], database=DEFAULT_DB):
-        self.connect()
-        tr = self._update(table, row, conditions)
-        response = self.transact(tr, database=database)
-        self.close()
-
-        return response
+        with self.transaction(database) as txn:
+            txn.update(table, row, conditions)
+        return txn.results[0]
 
 
     def mutate_map(self, table, mutations, conditions=[]):
-        self.connect()
-        tr = self._mutate(table, mutations, conditions)
-        response = self.transact(tr, database=DEFAULT_DB)
-        self.close()
-
-        return response
+        with self.transaction() as txn:
+            txn.mutate_map(table, mutations, conditions)
+        return txn.results[0]
 
 
     def map_set_key(self, table, column, key, value, conditions=[]):
-        self.connect()
-        mutations = [
-            [column, 'delete', ['set', [key]]],
-            [column, 'insert', ['map', [[key, value]]]],
-        ]
-        tr = self._mutate(table, mutations, conditions)
-        response = self.transact(tr, database=DEFAULT_DB)
-        self.close()
-
-        return response
+        with self.transaction() as txn:
+            txn.map_set_key(table, column, key, value, conditions)
+        return txn.results[0]
 
 
     def map_delete_key(self, table, column, key, conditions=[]):
-        self.connect()
-        mutations = [
-            [column, 'delete', ['set', [key]]],
-        ]
-        tr = self._mutate(table, mutations, conditions)
-        response = self.transact(tr, database=DEFAULT_DB)
-        self.close()
-
-        return response
+        with self.transaction() as txn:
+            txn.map_delete_key(table, column, key, conditions)
+        return txn.results[0]
@@ -0,0 +1,148 @@
+"""
+Evaluate OVSDB queries against table data held in memory.
+
+The conditions are the same "where" clauses that are sent to the server,
+lists of [column, function, value]. Values use the OVSDB JSON notation:
+
+  "eth1", 10, true                  atoms
+  ["uuid", "4e8c..."]               a reference to another row
+  ["set", ["eth1", "eth2"]]         a set of atoms
+  ["map", [["key", "value"], ...]]  a map of atoms to atoms
+
+An atom and a set containing only that atom are interchangeable, as they
+are in OVSDB. All functions in RFC 7047 are supported: ==, !=, includes,
+excludes, <, <=, >, >=.
+
+Usage:
+  interfaces = Table(indexes=('name',))
+  interfaces.update('4e8c...', {'name': 'eth1', 'mtu': 1500})
+  interfaces.select([['name', '==', 'eth1']]) => [('4e8c...', {...})]
+
+Equality conditions on indexed columns are answered from a hash index
+instead of looking at every row.
+"""
+import collections
+import operator
+
+
+# Columns that are indexed when they are replicated.
+INDEXES = {
+    'Interface': ('name',),
+    'Port': ('name',),
+    'VLAN': ('id',),
+}
+
+ORDERING = {
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+}
+
+
+def atom(value):
+    """Returns a hashable form of a single OVSDB atom."""
+    if isinstance(value, list):
+        # ["uuid", ...] or ["named-uuid", ...]
+        return tuple(value)
+    return value
+
+
+def datum(value):
+    """Returns a hashable form of any OVSDB value, as a frozenset."""
+    if isinstance(value, list) and value[0] == 'set':
+        return frozenset(atom(x) for x in value[1])
+    if isinstance(value, list) and value[0] == 'map':
+        return frozenset((atom(k), atom(v)) for k, v in value[1])
+    return frozenset((atom(value),))
+
+
+def matches(row, condition):
+    """Returns whether the row satisfies a single condition."""
+    column, function, value = condition
+    left = datum(row[column])
+    right = datum(value)
+    if function == '==':
+        return left == right
+    elif function == '!=':
+        return left != right
+    elif function == 'includes':
+        return right <= left
+    elif function == 'excludes':
+        return not (left & right)
+    elif function in ORDERING:
+        # Only defined for integers and reals, which may be an optional
+        # value (a set of zero or one elements).
+        if len(left) != 1 or len(right) != 1:
+            return False
+        return ORDERING[function](next(iter(left)), next(iter(right)))
+    raise ValueError('Unknown function %s' % function)
+
+
+class Table(object):
+    """The rows of one table, keyed by UUID, with hash indexes."""
+
+    def __init__(self, indexes=()):
+        self.rows = {}
+        # column -> datum -> set of UUIDs
+        self.indexes = {}
+        for column in indexes:
+            self.indexes[column] = collections.defaultdict(set)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def update(self, uuid, row):
+        """Insert a new row, or replace an existing one."""
+        if uuid in self.rows:
+            self.delete(uuid)
+        self.rows[uuid] = row
+        for column, index in self.indexes.iteritems():
+            if column in row:
+                index[datum(row[column])].add(uuid)
+
+    def delete(self, uuid):
+        row = self.rows.pop(uuid, None)
+        if row is None:
+            return
+        for column, index in self.indexes.iteritems():
+            if column not in row:
+                continue
+            key = datum(row[column])
+            uuids = index[key]
+            uuids.discard(uuid)
+            if not uuids:
+                del index[key]
+
+    def candidates(self, conditions):
+        """Returns the UUIDs of rows that may match, and the conditions
+        that still need to be checked against them."""
+        for i, condition in enumerate(conditions):
+            column, function, value = condition
+            if function != '==':
+                continue
+            rest = conditions[:i] + conditions[i + 1:]
+            if column == '_uuid':
+                uuid = value[1]
+                if uuid in self.rows:
+                    return (uuid,), rest
+                return (), rest
+            if column in self.indexes:
+                return self.indexes[column].get(datum(value), ()), rest
+        return self.rows.iterkeys(), conditions
+
+    def select(self, conditions=()):
+        """Returns (uuid, row) for every row matching all conditions."""
+        uuids, conditions = self.candidates(list(conditions))
+        results = []
+        for uuid in uuids:
+            row = self.rows[uuid]
+            for condition in conditions:
+                if condition[0] == '_uuid':
+                    if not matches({'_uuid': ['uuid', uuid]}, condition):
+                        break
+                elif not matches(row, condition):
+                    break
+            else:
+                results.append((uuid, row))
+        return results
@@ -0,0 +1,36 @@
+from opscli import ovsdb_query
+
+
+table = ovsdb_query.Table(indexes=('name',))
+table.update('u1', {'name': 'eth1', 'mtu': 1500, 'vlans': ['set', [1, 2]],
+                    'options': ['map', [['speed', '10G']]]})
+table.update('u2', {'name': 'eth2', 'mtu': 9000, 'vlans': 2,
+                    'options': ['map', []]})
+table.update('u3', {'name': 'eth3', 'mtu': ['set', []],
+                    'vlans': ['set', []], 'options': ['map', []]})
+
+
+def select(*conditions):
+    return sorted(uuid for uuid, row in table.select(conditions))
+
+print select(['name', '==', 'eth1']) == ['u1']
+print select(['name', '!=', 'eth1']) == ['u2', 'u3']
+print select(['mtu', '>', 1500]) == ['u2']
+print select(['mtu', '<=', 1500]) == ['u1']
+print select(['vlans', 'includes', 2]) == ['u1', 'u2']
+print select(['vlans', 'includes', ['set', [1, 2]]]) == ['u1']
+print select(['vlans', 'excludes', 1]) == ['u2', 'u3']
+print select(['vlans', '==', ['set', [2]]]) == ['u2']
+print select(['options', 'includes', ['map', [['speed', '10G']]]]) == ['u1']
+print select(['_uuid', '==', ['uuid', 'u3']]) == ['u3']
+print select(['name', '==', 'eth2'], ['mtu', '==', 1500]) == []
+print select() == ['u1', 'u2', 'u3']
+
+# Indexes follow updates and deletes
+table.update('u1', {'name': 'eth9', 'mtu': 1500, 'vlans': 1,
+                    'options': ['map', []]})
+print select(['name', '==', 'eth1']) == []
+print select(['name', '==', 'eth9']) == ['u1']
+table.delete('u1')
+print select(['name', '==', 'eth9']) == []
+print 'eth9' not in [str(list(x)[0]) for x in table.indexes['name']]
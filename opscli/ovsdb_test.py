@@ -0,0 +1,214 @@
+import json
+import socket
+import threading
+
+from opscli import ovsdb
+from opscli import ovsdb_query
+
+
+messages = [
+    {'id': 1, 'result': [{'rows': []}], 'error': None},
+    {'id': 2, 'result': [{'rows': [{'name': 'a "quoted" {brace}'}]}],
+     'error': None},
+    {'id': None, 'method': 'update', 'params': ['x', {'t': {}}]},
+    {'id': 3, 'result': [{'rows': [{'name': 'back\\slash \\"}'}]}],
+     'error': None},
+]
+data = ' '.join(json.dumps(x) for x in messages) + '\n'
+
+
+# Whole stream at once
+stream = ovsdb.JsonStream()
+print stream.feed(data) == messages
+
+
+# One byte at a time, including splits inside strings and escapes
+stream = ovsdb.JsonStream()
+result = []
+for char in data:
+    result += stream.feed(char)
+print result == messages
+
+
+# Leftover bytes are kept for the next message
+stream = ovsdb.JsonStream()
+first = json.dumps(messages[0])
+second = json.dumps(messages[1])
+print stream.feed(first + second[:10]) == [messages[0]]
+print stream.feed(second[10:]) == [messages[1]]
+
+
+# Garbage between messages
+stream = ovsdb.JsonStream()
+try:
+    stream.feed('{} x')
+    print False
+except ovsdb.ProtocolError:
+    print True
+
+
+# Pipelined requests, answered out of order
+class PairConnection(ovsdb.Connection):
+    def connect(self):
+        self.socket, self.peer = socket.socketpair()
+
+conn = PairConnection('unix:test')
+replies = [conn.request({'method': 'echo', 'params': [x]}) for x in range(3)]
+peer = ovsdb.JsonStream()
+requests = peer.feed(conn.peer.recv(4096))
+print [x['id'] for x in requests] == [1, 2, 3]
+
+conn.peer.sendall(json.dumps({'id': 'echo', 'method': 'echo', 'params': []}))
+for request in reversed(requests):
+    conn.peer.sendall(json.dumps(
+        {'id': request['id'], 'result': request['params'], 'error': None}))
+print [x.result()['result'] for x in replies] == [[0], [1], [2]]
+print peer.feed(conn.peer.recv(4096))[0]['id'] == 'echo'
+
+# Timeouts leave the request outstanding; cancelling it sends a notification
+reply = conn.request({'method': 'echo', 'params': []})
+try:
+    reply.result(timeout=0.01)
+    print False
+except ovsdb.TimeoutError:
+    print True
+done = []
+reply.add_done_callback(done.append)
+reply.cancel()
+print done == [reply]
+print peer.feed(conn.peer.recv(4096))[-1]['method'] == 'cancel'
+conn.peer.sendall(json.dumps({'id': reply.id, 'result': None,
+                              'error': 'canceled'}))
+conn.poll()
+print conn.pending == {} and conn.cancelled == set()
+
+# Blocking calls cancel the requests they give up on
+class PairOvsdb(ovsdb.Ovsdb):
+    def connection(self):
+        return conn
+
+db = PairOvsdb('unix:test', timeout=0.01)
+try:
+    db.query('System')
+    print False
+except ovsdb.TimeoutError:
+    print True
+print conn.pending == {} and len(conn.cancelled) == 1
+print peer.feed(conn.peer.recv(4096))[-1]['method'] == 'cancel'
+
+# Outstanding replies fail when the connection goes away
+reply = conn.request({'method': 'echo', 'params': []})
+conn.peer.close()
+try:
+    reply.result()
+    print False
+except ovsdb.ConnectionClosedError:
+    print True
+
+
+# Replica bookkeeping
+replica = ovsdb.Replica(None, {'VLAN': None, 'System': ['hostname']})
+replica.data = {'VLAN': ovsdb_query.Table(('id',)),
+                'System': ovsdb_query.Table()}
+replica.apply({'VLAN': {'u1': {'new': {'id': 1}}, 'u2': {'new': {'id': 2}}}})
+replica.apply({'VLAN': {'u1': {'old': {'id': 1}}}})
+print replica.get('VLAN') == [{'id': 2, '_uuid': ['uuid', 'u2']}]
+print replica.covers('System', ['hostname'])
+print not replica.covers('System', None)
+print not replica.covers('Port', None)
+print replica.get('VLAN', ['id'], [['id', '==', 2]]) == [{'id': 2}]
+print not replica.covers('System', ['hostname'], [['mtu', '==', 1]])
+
+# Updates wait for readers to let go of the rows
+replica.ready = True
+with replica.lock:
+    thread = threading.Thread(target=replica.update, args=(
+        'opscli', {'VLAN': {'u3': {'new': {'id': 3}}}}))
+    thread.start()
+    thread.join(0.05)
+    print len(replica.data['VLAN']) == 1
+thread.join()
+print len(replica.get('VLAN')) == 2
+
+# A thread that reads an update while another one syncs doesn't wait on it
+reading = threading.Event()
+
+class ReadingConnection(PairConnection):
+    def receive(self, timeout=None):
+        reading.set()
+        return super(ReadingConnection, self).receive(timeout)
+
+class ReplicaOvsdb(ovsdb.Ovsdb):
+    def connection(self):
+        return self.conn
+
+db = ReplicaOvsdb('unix:test', timeout=1)
+db.conn = ReadingConnection('unix:test')
+peer = ovsdb.JsonStream()
+db.replicate({'VLAN': None})
+monitor = peer.feed(db.conn.peer.recv(4096))[0]
+db.conn.peer.sendall(json.dumps({'id': monitor['id'], 'error': None,
+                                 'result': {'VLAN': {'u1': {'new': {'id': 1}}}}}))
+db.poll()
+print db.replica.sync()
+db.replica.written()
+
+results = {}
+reading.clear()
+reader = threading.Thread(target=lambda: results.update(
+    query=db.query('VLAN')))
+reader.daemon = True
+reader.start()
+# The reader waits for its reply before the syncing thread does
+reading.wait(1)
+syncer = threading.Thread(target=lambda: results.update(get=db.get('VLAN')))
+syncer.daemon = True
+syncer.start()
+requests = []
+while len(requests) < 2:
+    requests += peer.feed(db.conn.peer.recv(4096))
+print sorted(x['method'] for x in requests) == ['echo', 'transact']
+# The update arrives before either reply
+messages = [{'id': None, 'method': 'update',
+             'params': ['opscli', {'VLAN': {'u2': {'new': {'id': 2}}}}]}]
+for request in requests:
+    messages.append({'id': request['id'], 'error': None,
+                     'result': [{'rows': []}]})
+db.conn.peer.sendall(''.join(json.dumps(x) for x in messages))
+reader.join(5)
+syncer.join(5)
+print not reader.is_alive() and not syncer.is_alive()
+print results.get('query') == []
+print sorted(x['id'] for x in results.get('get', [])) == [1, 2]
+
+
+# Transactions collect operations and send them together
+class FakeOvsdb(ovsdb.Ovsdb):
+    def request(self, msg, unpack=None):
+        self.sent.append(msg)
+        count = len(msg['params']) - 1
+        class Done(object):
+            def result(unused_self, unused_timeout=None):
+                return unpack({'error': None, 'result': [{'count': 1}] * count})
+        return Done()
+
+db = FakeOvsdb('unix:test')
+db.sent = []
+with db.transaction() as txn:
+    txn.map_set_key('System', 'other_config', 'lldp_hold', '4')
+    txn.map_delete_key('System', 'other_config', 'lldp_mgmt_addr')
+    txn.update('System', {'hostname': 'switch'})
+print len(db.sent) == 1
+operations = db.sent[0]['params'][1:]
+print [x['op'] for x in operations] == ['mutate', 'mutate', 'update']
+print txn.results == [{'count': 1}] * 3
+
+# Nothing is sent if the block fails
+db.sent = []
+try:
+    with db.transaction() as txn:
+        txn.map_set_key('System', 'other_config', 'lldp_hold', '4')
+        raise ValueError
+except ValueError:
+    pass
+print db.sent == []
@@ -0,0 +1,195 @@
+"""
+Filters for the output of piped commands.
+
+The commands after a '|' on a command line are filters:
+  show running-config | include hostname
+  show running-config | section interface | count
+
+The output of a command is treated as a stream of lines. Every filter
+takes the lines of the command before it and yields the lines it lets
+through, so output is only produced as it is consumed and never has to be
+held in full. Once the consumer stops reading, nothing more is produced.
+
+# Filters
+A filter is much like a Utility command: its options are tokens and
+filter() is called with the transformed options, after the lines.
+
+class Head(pipe.Filter):
+    '''Only show the first lines'''
+
+    options = token.construct(NumberType())
+
+    def filter(self, lines, count):
+        for line in itertools.islice(lines, count):
+            yield line
+
+Filters are looked up in a match tree of their own, see build_tree().
+
+# Usage
+lines = pipe.run(output, [(Include(), [re.compile('hostname')])])
+"""
+import abc
+import collections
+import re
+
+from opscli.command import match
+from opscli.command import token
+
+
+class Filter(object):
+    """Abstract filter base class."""
+
+    __metaclass__ = abc.ABCMeta
+
+    # Default to no arguments required
+    options = (list(), )
+
+    def __call__(self, lines, *options):
+        return self.filter(lines, *options)
+
+    @abc.abstractmethod
+    def filter(self, lines, *options):
+        """Yields the lines to pass on."""
+        pass
+
+
+class PatternType(token.Token):
+    """Matches a regular expression."""
+
+    def match(self, word):
+        try:
+            re.compile(word)
+        except re.error:
+            return False
+        return True
+
+    def transform(self, word):
+        return re.compile(word)
+
+
+Pattern = PatternType()
+
+
+class Include(Filter):
+    """Only show lines that match a pattern"""
+
+    options = token.construct(Pattern)
+
+    def filter(self, lines, pattern):
+        for line in lines:
+            if pattern.search(line):
+                yield line
+
+
+class Exclude(Filter):
+    """Hide lines that match a pattern"""
+
+    options = token.construct(Pattern)
+
+    def filter(self, lines, pattern):
+        for line in lines:
+            if not pattern.search(line):
+                yield line
+
+
+class Begin(Filter):
+    """Show lines from the first one that matches a pattern"""
+
+    options = token.construct(Pattern)
+
+    def filter(self, lines, pattern):
+        lines = iter(lines)
+        for line in lines:
+            if pattern.search(line):
+                yield line
+                break
+        for line in lines:
+            yield line
+
+
+class Count(Filter):
+    """Count the lines, or the lines that match a pattern"""
+
+    options = token.construct([Pattern])
+
+    def filter(self, lines, pattern=None):
+        count = 0
+        for line in lines:
+            if pattern is None or pattern.search(line):
+                count += 1
+        yield 'Count: %d' % count
+
+
+class Section(Filter):
+    """Show lines that match a pattern and the indented lines after them"""
+
+    options = token.construct(Pattern)
+
+    def filter(self, lines, pattern):
+        in_section = False
+        for line in lines:
+            if line[:1].isspace():
+                if in_section:
+                    yield line
+            else:
+                in_section = pattern.search(line) is not None
+                if in_section:
+                    yield line
+
+
+FILTERS = collections.OrderedDict((
+    ('begin', Begin),
+    ('count', Count),
+    ('exclude', Exclude),
+    ('include', Include),
+    ('section', Section),
+))
+
+
+def build_tree(filters=FILTERS):
+    """Build a match tree for filters by name.
+
+    The values of the match groups are the filter classes.
+    """
+    tree = match.Tree()
+    for name, cls in filters.iteritems():
+        tree.add(match.MatchGroup(
+            [token.LiteralType(name)], token.compile(cls.options), cls))
+    return tree
+
+
+def split(text):
+    """Yields the lines in text."""
+    start = 0
+    end = text.find('\n')
+    while end >= 0:
+        yield text[start:end]
+        start = end + 1
+        end = text.find('\n', start)
+    if start < len(text):
+        yield text[start:]
+
+
+def lines(output):
+    """Yields the lines of the output of a command.
+
+    Output can be a string or an iterable of strings of one or more lines.
+    """
+    if output is None:
+        return
+    if isinstance(output, basestring):
+        output = (output, )
+    for text in output:
+        for line in split(text):
+            yield line
+
+
+def run(output, filters):
+    """Returns the lines of output passed through filters.
+
+    @args filters List of (filter, options)
+    """
+    stream = lines(output)
+    for pipe_filter, options in filters:
+        stream = pipe_filter(stream, *options)
+    return stream
@@ -0,0 +1,57 @@
+import re
+
+from opscli import pipe
+
+
+CONFIG = '''hostname switch
+interface 1
+  description uplink
+  no shutdown
+interface 2
+  shutdown
+router bgp 1
+  neighbor 10.0.0.1
+'''
+
+
+def run(*filters):
+    return list(pipe.run(CONFIG, filters))
+
+
+def pattern(regex):
+    return [re.compile(regex)]
+
+print run() == CONFIG.splitlines()
+print run((pipe.Include(), pattern('host'))) == ['hostname switch']
+print run((pipe.Exclude(), pattern('^ '))) == [
+    'hostname switch', 'interface 1', 'interface 2', 'router bgp 1']
+print run((pipe.Begin(), pattern('router'))) == [
+    'router bgp 1', '  neighbor 10.0.0.1']
+print run((pipe.Section(), pattern('interface 2'))) == [
+    'interface 2', '  shutdown']
+print run((pipe.Count(), [])) == ['Count: 8']
+print run((pipe.Section(), pattern('interface')),
+          (pipe.Count(), pattern('shutdown'))) == ['Count: 2']
+
+# Output can be made of chunks of lines, and is only read as needed
+read = []
+
+
+def output():
+    for i in range(1000):
+        read.append(i)
+        yield 'line %d\nmore %d' % (i, i)
+
+lines = pipe.run(output(), [(pipe.Include(), pattern('more'))])
+print next(lines) == 'more 0'
+print len(read) == 1
+print pipe.run(None, [(pipe.Count(), [])]).next() == 'Count: 0'
+print list(pipe.split('a\n\nb')) == ['a', '', 'b']
+
+# Filters are found by name like commands
+tree = pipe.build_tree()
+group = next(tree.match(['inc', 'x']))
+print group.value is pipe.Include
+print [str(x) for x in group.secondary] == ['PatternType']
+print next(tree.match(['count']), None) is not None
+print next(tree.match(['include', '(']), None) is None
@@ -0,0 +1,192 @@
+"""
+A JSON-RPC 2.0 endpoint for running commands from programs.
+
+Requests and responses are JSON objects, one per line, read from a stream
+like stdin, or from a client of a Unix socket (see server.Server). Lines
+can be given as they would be typed, or already split into commands of
+words:
+
+  {"jsonrpc": "2.0", "id": 1, "method": "run",
+   "params": {"line": "show interface 1 | include mtu"}}
+  {"jsonrpc": "2.0", "id": 2, "method": "run",
+   "params": {"words": [["show", "interface", "1"], ["include", "mtu"]],
+              "context": ["configure terminal"]}}
+
+"context" lists the lines, or words, that lead from the root to the context
+to run in. Every request starts from the root, so requests don't depend on
+each other. They are run concurrently by a pool of workers, and the
+responses are sent as they finish, in any order:
+
+  {"jsonrpc": "2.0", "id": 2,
+   "result": {"output": ["mtu 1500"], "prompt": "(config)", "time": 0.0012}}
+
+"time" is the seconds it took to run the request.
+
+Errors have the JSON-RPC codes, or these for commands:
+  COMMAND_NOT_FOUND  No command matches a line.
+  INVALID_INPUT      A line couldn't be parsed.
+The data of a command error has the error type and the index of the
+context line that failed, or null for the line itself.
+"""
+import json
+import logging
+import Queue
+import threading
+import time
+
+from opscli import cli
+from opscli import linehelper
+from opscli import pipe
+
+
+PARSE_ERROR = -32700
+INVALID_REQUEST = -32600
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS = -32602
+INTERNAL_ERROR = -32603
+COMMAND_NOT_FOUND = 1
+INVALID_INPUT = 2
+
+# Requests run at the same time, each in a session of its own.
+WORKERS = 4
+
+
+class RequestError(Exception):
+    """A request failed with a JSON-RPC error."""
+
+    def __init__(self, code, message, data=None):
+        super(RequestError, self).__init__(code, message, data)
+        self.error = {'code': code, 'message': message}
+        if data is not None:
+            self.error['data'] = data
+
+
+class Endpoint(object):
+    """Answers the requests read from infile on outfile."""
+
+    def __init__(self, shell, infile, outfile, workers=WORKERS):
+        self.shell = shell
+        self.infile = infile
+        self.outfile = outfile
+        self.workers = workers
+        self.requests = Queue.Queue()
+        self.lock = threading.Lock()
+        self.methods = {
+            'run': self.run,
+        }
+
+    @classmethod
+    def on_socket(cls, shell, sock):
+        """For server.Server, serving requests from sock."""
+        return cls(shell, sock.makefile('rb'), sock.makefile('wb'))
+
+    def serve(self):
+        """Answer requests until infile ends."""
+        threads = []
+        for _ in range(self.workers):
+            thread = threading.Thread(target=self.work)
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        for line in iter(self.infile.readline, ''):
+            if line.strip():
+                self.requests.put(line)
+        for thread in threads:
+            self.requests.put(None)
+        for thread in threads:
+            thread.join()
+
+    def work(self):
+        session = self.shell.new_session()
+        while True:
+            line = self.requests.get()
+            if line is None:
+                return
+            response = self.handle(session, line)
+            if response is not None:
+                self.send(response)
+
+    def send(self, response):
+        data = json.dumps(response, separators=(',', ':')) + '\n'
+        with self.lock:
+            self.outfile.write(data)
+            self.outfile.flush()
+
+    def handle(self, session, line):
+        """Returns the response to a request, or None for notifications."""
+        request = {}
+        try:
+            try:
+                request = json.loads(line)
+            except ValueError:
+                raise RequestError(PARSE_ERROR, 'Parse error')
+            if (not isinstance(request, dict) or
+                    request.get('jsonrpc') != '2.0' or
+                    not isinstance(request.get('method'), basestring)):
+                request = {}
+                raise RequestError(INVALID_REQUEST, 'Invalid Request')
+            method = self.methods.get(request['method'])
+            if method is None:
+                raise RequestError(METHOD_NOT_FOUND, 'Method not found')
+            params = request.get('params', {})
+            if not isinstance(params, dict):
+                raise RequestError(INVALID_PARAMS, 'Invalid params')
+            result = method(session, **params)
+        except RequestError as e:
+            result = None
+            error = e.error
+        except Exception:
+            logging.exception('Request failed: %s', line)
+            result = None
+            error = {'code': INTERNAL_ERROR, 'message': 'Internal error'}
+        if request and 'id' not in request:
+            return None
+        response = {'jsonrpc': '2.0', 'id': request.get('id')}
+        if result is None:
+            response['error'] = error
+        else:
+            response['result'] = result
+        return response
+
+    def process(self, session, entry, step=None):
+        """Run a line or words, returning its output."""
+        if isinstance(entry, basestring):
+            line = entry
+            run = session.process_line
+        elif (isinstance(entry, list) and entry and
+              isinstance(entry[0], list)):
+            line = ' | '.join(' '.join(words) for words in entry)
+            run = session.process_words
+        elif isinstance(entry, list) and entry:
+            line = ' '.join(entry)
+            entry = [entry]
+            run = session.process_words
+        else:
+            raise RequestError(INVALID_PARAMS, 'Invalid params')
+        try:
+            return run(entry)
+        except linehelper.Error as e:
+            if isinstance(e, linehelper.CommandNotFoundError):
+                code = COMMAND_NOT_FOUND
+            else:
+                code = INVALID_INPUT
+            raise RequestError(code, cli.error_message(e, line), {
+                'type': e.__class__.__name__, 'step': step})
+
+    def run(self, session, line=None, words=None, context=(), **unknown):
+        start = time.time()
+        if unknown or (line is None) == (words is None):
+            raise RequestError(INVALID_PARAMS, 'Invalid params')
+        session.reset()
+        for step, entry in enumerate(context):
+            ret = self.process(session, entry, step)
+            # Output is read to run the command
+            if ret is not None and ret != cli.ExitMarker:
+                for _ in pipe.lines(ret):
+                    pass
+        ret = self.process(session, line if words is None else words)
+        output = []
+        if ret is not None and ret != cli.ExitMarker:
+            output = list(pipe.lines(ret))
+        return {'output': output, 'prompt': session.linehelper.prompt,
+                'time': time.time() - start}
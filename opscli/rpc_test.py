@@ -0,0 +1,74 @@
+import json
+import StringIO
+import threading
+
+from opscli import rpc
+from opscli import testing
+from opscli.command import command
+
+
+released = threading.Event()
+
+
+class Wait(command.Utility):
+    def command(self):
+        released.wait(10)
+        return str(released.is_set())
+
+
+class Release(command.Utility):
+    def command(self):
+        released.set()
+
+
+def register(root, everywhere):
+    testing.register(root, everywhere)
+    root.wait = Wait
+    root.release = Release
+
+
+def request(request_id, **params):
+    return json.dumps({'jsonrpc': '2.0', 'id': request_id, 'method': 'run',
+                       'params': params})
+
+
+def serve(*requests):
+    infile = StringIO.StringIO('\n'.join(requests) + '\n')
+    outfile = StringIO.StringIO()
+    rpc.Endpoint(shell, infile, outfile, workers=2).serve()
+    responses = [json.loads(x) for x in outfile.getvalue().splitlines()]
+    return responses, dict((x['id'], x) for x in responses)
+
+shell = testing.shell(register)
+_, responses = serve(
+    request(1, line='show | include 1'),
+    request(2, words=['show'], context=['vlan']),
+    request(3, words=[['show'], ['count']], context=[['vlan']]),
+    request(4, line='show', context=['vlan', 'bogus']),
+    request(5, line='show "x'),
+    request(6, words=['show'], extra=True),
+    '{"jsonrpc": "2.0", "method": "run", "params": {"line": "show"}}',
+    '{"jsonrpc": "2.0", "id": 8, "method": "stop"}')
+result = responses[1]['result']
+print result['output'] == ['row 1 in (root) >']
+print result['prompt'] == '(root) >'
+print isinstance(result['time'], float)
+print responses[2]['result']['output'] == [
+    'row 0 in (vlan)', 'row 1 in (vlan)', 'row 2 in (vlan)']
+print responses[2]['result']['prompt'] == '(vlan)'
+print responses[3]['result']['output'] == ['Count: 3']
+print responses[4]['error'] == {
+    'code': rpc.COMMAND_NOT_FOUND, 'message': 'Command not found: bogus',
+    'data': {'type': 'CommandNotFoundError', 'step': 1}}
+print responses[5]['error']['code'] == rpc.COMMAND_NOT_FOUND
+print responses[6]['error']['code'] == rpc.INVALID_PARAMS
+print 7 not in responses
+print responses[8]['error']['code'] == rpc.METHOD_NOT_FOUND
+codes = sorted(x['error']['code'] for x in serve('{"id": 9}', '{')[0])
+print codes == [rpc.PARSE_ERROR, rpc.INVALID_REQUEST]
+
+# Requests run concurrently, and are answered as they finish
+responses, by_id = serve(
+    request(1, line='wait'), request(2, line='release'))
+print [x['id'] for x in responses] == [2, 1]
+print by_id[1]['result']['output'] == ['True']
@@ -0,0 +1,292 @@
+"""
+Serve shell sessions over a Unix socket.
+
+Starting a shell means loading the command modules, building the match
+trees and connecting to OVSDB. A server does that once, and any number of
+clients (see client.py) then get a session of their own on it, each with
+its own place in the context tree.
+
+# Protocol
+Every message is a JSON object on a line of its own. The client sends
+requests:
+  {"id": 1, "method": "process", "params": {"line": "show vlan"}}
+and the server answers each with a result or an error:
+  {"id": 1, "result": {"prompt": "(config)", "exit": false}}
+  {"id": 1, "error": {"type": "CommandNotFoundError",
+                      "message": "Command not found: show vlan"}}
+
+The output of "process" is sent before its result, a chunk of lines at a
+time:
+  {"id": 1, "output": "VLAN 1\\nVLAN 2\\n"}
+A client that doesn't want the rest of it sends
+  {"id": 2, "method": "cancel", "params": {"id": 1}}
+after which the result follows the chunks already sent. Cancel requests
+aren't answered.
+
+Methods:
+  session                      motd, prompt_base and prompt
+  process   line               runs a line, see cli.Session.process_line()
+  qhelp     line               help items for a line
+  complete  line               completions for a line
+  cancel    id                 stops the output of a request
+"""
+import collections
+import json
+import logging
+import os
+import select
+import socket
+import stat
+import threading
+import time
+
+from opscli import cli
+from opscli import linehelper
+
+
+# Output is sent once this many characters are waiting, or once this many
+# seconds have passed since it was last sent.
+OUTPUT_CHUNK_SIZE = 16384
+OUTPUT_FLUSH_INTERVAL = 0.1
+
+# Connections waiting to be accepted.
+BACKLOG = 16
+
+# Permissions of the socket. Whoever can connect runs commands with the
+# privileges of the server, so by default only its own user can.
+SOCKET_MODE = 0600
+
+
+class Error(Exception):
+    """Base error class for this module."""
+    pass
+
+
+class ProtocolError(Error):
+    """A message wasn't understood."""
+    pass
+
+
+class AddressInUseError(Error):
+    """Something other than a stale socket is at the path to serve on."""
+    pass
+
+
+class Channel(object):
+    """JSON messages, one per line, over a socket."""
+
+    def __init__(self, sock):
+        self.socket = sock
+        self.buffer = ''
+        # Messages received but not handled yet
+        self.pending = collections.deque()
+
+    def send(self, message):
+        self.socket.sendall(json.dumps(message, separators=(',', ':')) + '\n')
+
+    def receive(self):
+        """Returns the next message, or None when the other side is gone."""
+        if self.pending:
+            return self.pending.popleft()
+        while '\n' not in self.buffer:
+            data = self.socket.recv(65536)
+            if not data:
+                return None
+            self.buffer += data
+        line, self.buffer = self.buffer.split('\n', 1)
+        try:
+            return json.loads(line)
+        except ValueError:
+            raise ProtocolError(line)
+
+    def poll(self):
+        """Returns if a message can be received without waiting."""
+        if self.pending or '\n' in self.buffer:
+            return True
+        readable, _, _ = select.select([self.socket], [], [], 0)
+        return bool(readable)
+
+
+class Connection(object):
+    """Answers the requests of a client on a session of its own."""
+
+    def __init__(self, shell, sock):
+        self.shell = shell
+        self.session = shell.new_session()
+        self.channel = Channel(sock)
+        self.methods = {
+            'session': self.do_session,
+            'process': self.do_process,
+            'qhelp': self.do_qhelp,
+            'complete': self.do_complete,
+        }
+
+    def serve(self):
+        while True:
+            request = self.channel.receive()
+            if request is None:
+                return
+            self.handle(request)
+
+    def handle(self, request):
+        if request.get('method') == 'cancel':
+            # The request has already finished
+            return
+        request_id = request.get('id')
+        method = self.methods.get(request.get('method'))
+        try:
+            if method is None:
+                raise ProtocolError('Unknown method')
+            result = method(request_id, **request.get('params', {}))
+        except linehelper.Error as e:
+            self.send_error(
+                request_id, e, request.get('params', {}).get('line'))
+            return
+        except (Error, TypeError) as e:
+            self.send_error(request_id, e, str(e))
+            return
+        except socket.error:
+            # The client went away
+            raise
+        except Exception as e:
+            # A command failed; the session carries on
+            logging.exception('Request failed: %s', request)
+            self.send_error(
+                request_id, e, request.get('params', {}).get('line'))
+            return
+        self.channel.send({'id': request_id, 'result': result})
+
+    def send_error(self, request_id, error, line):
+        if isinstance(error, (Error, TypeError)):
+            message = 'Bad request: %s' % line
+        else:
+            message = cli.error_message(error, line)
+        self.channel.send({'id': request_id, 'error': {
+            'type': error.__class__.__name__, 'message': message}})
+
+    def prompt(self):
+        return self.session.linehelper.prompt
+
+    def do_session(self, unused_id):
+        return {'motd': self.shell.motd, 'prompt_base': self.shell.prompt_base,
+                'prompt': self.prompt()}
+
+    def do_process(self, request_id, line):
+        ret = self.session.process_line(line)
+        if ret == cli.ExitMarker:
+            return {'exit': True}
+        if ret is not None:
+            self.send_output(request_id, ret)
+        return {'exit': False, 'prompt_base': self.shell.prompt_base,
+                'prompt': self.prompt()}
+
+    def do_qhelp(self, unused_id, line):
+        return self.session.linehelper.qhelp(line)
+
+    def do_complete(self, unused_id, line):
+        return self.session.linehelper.complete(line)
+
+    def cancelled(self, request_id):
+        """Returns if the client has cancelled request_id.
+
+        Other requests that arrived are left for later.
+        """
+        while self.channel.poll():
+            request = self.channel.receive()
+            if request is None:
+                return True
+            if (request.get('method') == 'cancel' and
+                    request.get('params', {}).get('id') == request_id):
+                return True
+            self.channel.pending.append(request)
+        return False
+
+    def send_output(self, request_id, output):
+        """Send output a chunk at a time, as it is produced."""
+        if isinstance(output, basestring):
+            output = (output, )
+        output = iter(output)
+        chunk = []
+        size = 0
+        sent = time.time()
+        for text in output:
+            if not text:
+                continue
+            chunk.append(text)
+            size += len(text)
+            if text[-1] != '\n':
+                chunk.append('\n')
+            if (size >= OUTPUT_CHUNK_SIZE or
+                    time.time() - sent >= OUTPUT_FLUSH_INTERVAL):
+                self.channel.send({'id': request_id, 'output': ''.join(chunk)})
+                chunk = []
+                size = 0
+                sent = time.time()
+                if self.cancelled(request_id):
+                    if hasattr(output, 'close'):
+                        output.close()
+                    return
+        if chunk:
+            self.channel.send({'id': request_id, 'output': ''.join(chunk)})
+
+
+class Server(object):
+    """Accepts clients on a Unix socket, each served by a thread.
+
+    Clients are served by a Connection, or by what connection returns for
+    the shell and socket, like rpc.Endpoint.on_socket().
+
+    The socket left behind by a server that is gone is replaced, but not
+    the one of a server that still answers. The socket gets mode.
+    """
+
+    def __init__(self, shell, path, connection=Connection, mode=SOCKET_MODE):
+        self.shell = shell
+        self.path = path
+        self.connection = connection
+        self.remove_stale()
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        # Nobody else can connect before the mode is set
+        umask = os.umask(0177)
+        try:
+            self.socket.bind(path)
+        finally:
+            os.umask(umask)
+        os.chmod(path, mode)
+        self.socket.listen(BACKLOG)
+
+    def remove_stale(self):
+        try:
+            mode = os.lstat(self.path).st_mode
+        except OSError:
+            return
+        if not stat.S_ISSOCK(mode):
+            raise AddressInUseError('%s is not a socket' % self.path)
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(self.path)
+        except socket.error:
+            # Nothing is listening on it
+            os.unlink(self.path)
+            return
+        finally:
+            probe.close()
+        raise AddressInUseError('A server is running on %s' % self.path)
+
+    def serve_forever(self):
+        while True:
+            sock, _ = self.socket.accept()
+            thread = threading.Thread(target=self.serve, args=(sock, ))
+            thread.daemon = True
+            thread.start()
+
+    def serve(self, sock):
+        try:
+            self.connection(self.shell, sock).serve()
+        except socket.error:
+            # The client went away
+            pass
+        except Exception:
+            logging.exception('Session failed')
+        finally:
+            sock.close()
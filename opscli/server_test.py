@@ -0,0 +1,128 @@
+import os
+import socket
+import stat
+import threading
+
+from opscli import cli
+from opscli import client
+from opscli import linehelper
+from opscli import server
+from opscli import testing
+from opscli.command import command
+
+
+produced = []
+
+
+class Rows(command.Utility):
+    def command(self):
+        for i in range(100000):
+            produced.append(i)
+            yield 'row %d' % i
+
+
+class Fail(command.Utility):
+    def command(self):
+        yield 'first'
+        raise RuntimeError('no database')
+
+
+class Stubborn(command.Utility):
+    def command(self):
+        try:
+            for i in range(100000):
+                yield 'row %d' % i
+        finally:
+            raise RuntimeError('cleanup failed')
+
+
+class Quit(command.Utility):
+    def command(self):
+        return cli.ExitMarker
+
+
+def register(root, everywhere):
+    testing.register(root, everywhere)
+    root.rows = Rows
+    root.fail = Fail
+    root.stubborn = Stubborn
+    everywhere.quit = Quit
+
+with testing.directory() as path:
+    shell = testing.shell(register)
+    socket_path = os.path.join(path, 'socket')
+    thread = threading.Thread(
+        target=server.Server(shell, socket_path).serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    # Every client has a session of its own
+    first = client.Client(socket_path)
+    second = client.Client(socket_path)
+    print first.session['prompt_base'] == 'Openswitch'
+    print list(first.process('vlan')) == []
+    print first.result['prompt'] == '(vlan)'
+    print second.call('qhelp', line='') == [
+        'fail', 'quit', 'rows', 'show', 'stubborn', 'vlan']
+    print first.helper.qhelp('') == ['quit', 'show']
+    print second.helper.complete('vl') == ['an']
+
+    # Errors are raised as they would be locally
+    try:
+        list(second.process('bogus'))
+        print False
+    except linehelper.CommandNotFoundError as e:
+        print e.args[0] == 'Command not found: bogus'
+
+    # and commands that fail don't end the session
+    try:
+        list(second.process('fail'))
+        print False
+    except client.RequestError as e:
+        print e.args[0] == 'Command failed: fail: no database'
+    print second.call('qhelp', line='') == [
+        'fail', 'quit', 'rows', 'show', 'stubborn', 'vlan']
+
+    # even when they fail while being stopped
+    output = second.process('stubborn')
+    next(output)
+    output.close()
+    print second.result is None
+
+    # Output arrives in chunks and can be stopped
+    output = second.process('rows')
+    print next(output).startswith('row 0\nrow 1\n')
+    output.close()
+    print second.result['prompt'] == str(shell.session.context)
+    print len(produced) < 100000
+    print list(second.process('rows | count')) == ['Count: 100000\n']
+
+    print list(first.process('quit')) == []
+    print first.result['exit']
+
+    # Only the server's user can connect
+    print stat.S_IMODE(os.stat(socket_path).st_mode) == 0600
+
+    # A running server keeps its socket
+    try:
+        server.Server(shell, socket_path)
+        print False
+    except server.AddressInUseError:
+        print list(second.process('vlan')) == []
+
+    # but the socket of one that is gone is replaced
+    stale_path = os.path.join(path, 'stale')
+    stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    stale.bind(stale_path)
+    stale.close()
+    server.Server(shell, stale_path, mode=0660)
+    print stat.S_IMODE(os.stat(stale_path).st_mode) == 0660
+
+    # Files that aren't sockets are left alone
+    other_path = os.path.join(path, 'other')
+    open(other_path, 'w').close()
+    try:
+        server.Server(shell, other_path)
+        print False
+    except server.AddressInUseError:
+        print os.path.exists(other_path)
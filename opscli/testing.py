@@ -0,0 +1,74 @@
+"""
+Fixtures shared by the tests.
+
+Tests of the shell build its context trees in-process with shell(). The
+commands of register() are there for them to start from:
+  vlan          enters (vlan)
+  show          three rows that say which context they are shown in
+
+Tests of module loading write their modules to a directory of their own
+with directory(), which also holds anything else a test needs on disk.
+
+Usage:
+  def register(root, everywhere):
+      testing.register(root, everywhere)
+      root.fail = Fail
+
+  shell = testing.shell(register)
+
+  with testing.directory(my_module=SOURCE) as path:
+      shell = cli.Opscli(None, module_paths=[path], interactive=False)
+"""
+import contextlib
+import os
+import shutil
+import tempfile
+
+from opscli import cli
+from opscli.command import command
+from opscli.command import context
+
+
+class VlanContext(context.Context):
+    prompt = '(vlan)'
+
+
+class Vlan(command.Utility):
+    def command(self):
+        return self.context()
+
+
+class Show(command.Utility):
+    def command(self):
+        for i in range(3):
+            yield 'row %d in %s' % (i, self.context)
+
+
+def register(root, everywhere):
+    root.vlan = VlanContext
+    root.vlan = Vlan
+    root.show = Show
+    root.vlan.show = Show
+
+
+def shell(register=register):
+    """Returns an Opscli with the commands register(root, everywhere)
+    adds, without loading any modules."""
+    shell = cli.Opscli(None, module_paths=[], interactive=False)
+    register(shell.root, shell.global_root)
+    shell.linehelper.invalidate()
+    return shell
+
+
+@contextlib.contextmanager
+def directory(**modules):
+    """Makes a directory for the block, with modules in it by name and
+    source, and removes it after."""
+    path = tempfile.mkdtemp()
+    try:
+        for name, source in modules.iteritems():
+            with open(os.path.join(path, name + '.py'), 'w') as f:
+                f.write(source)
+        yield path
+    finally:
+        shutil.rmtree(path)
@@ -80,63 +80,66 @@ class Conf_lldp(Command):
     )
 
     def run(self, opts, flags):
-        while opts:
-            if opts[0] == 'enable':
-                value = F_NO not in flags
-                ovsdb.map_set_key('System', 'other_config', 'lldp_enable',
-                                  str(value).lower())
-                opts.pop(0)
-
-            elif opts[0] == 'management-address':
-                if F_NO in flags:
-                    ovsdb.map_delete_key('System', 'other_config',
-                                         'lldp_mgmt_addr')
-                else:
-                    ovsdb.map_set_key('System', 'other_config',
-                                      'lldp_mgmt_addr', str(opts[1]))
-                opts.pop(0)
-                opts.pop(0)
-
-            elif opts[0] == 'holdtime':
-                if F_NO in flags:
-                    ovsdb.map_delete_key('System', 'other_config', 'lldp_hold')
-                else:
-                    ovsdb.map_set_key('System', 'other_config', 'lldp_hold',
-                                      str(opts[1]))
-                opts.pop(0)
-                opts.pop(0)
-
-            elif opts[0] == 'timer':
-                if F_NO in flags:
-                    ovsdb.map_delete_key('System', 'other_config',
-                                         'lldp_tx_interval')
-                else:
-                    ovsdb.map_set_key('System', 'other_config',
-                                      'lldp_tx_interval', str(opts[1]))
-                opts.pop(0)
-                opts.pop(0)
-
-            elif opts[0] == 'select-tlv':
-                for word, map_key, descr in tlv_keys:
-                    if opts[1] == word:
-                        key = map_key
-                        break
-                value = str(F_NO not in flags).lower()
-                ovsdb.map_set_key('System', 'other_config', key, value)
-                opts.pop(0)
-                opts.pop(0)
-
-            elif opts[0] == 'clear':
-                if opts[1] == 'counters':
-                    sem = 'lldp_num_clear_counters_requested'
-                elif opts[1] == 'neighbors':
-                    sem = 'lldp_num_clear_table_requested'
-                req = ovsdb.get_map('System', 'status')
-                counter = int(req.get(sem, 0))
-                counter += 1
-                ovsdb.map_set_key('System', 'status', sem, str(counter))
-                opts.pop(0)
-                opts.pop(0)
+        # All keywords on the line are committed in one transaction.
+        with ovsdb.transaction() as txn:
+            while opts:
+                if opts[0] == 'enable':
+                    value = F_NO not in flags
+                    txn.map_set_key('System', 'other_config', 'lldp_enable',
+                                    str(value).lower())
+                    opts.pop(0)
+
+                elif opts[0] == 'management-address':
+                    if F_NO in flags:
+                        txn.map_delete_key('System', 'other_config',
+                                           'lldp_mgmt_addr')
+                    else:
+                        txn.map_set_key('System', 'other_config',
+                                        'lldp_mgmt_addr', str(opts[1]))
+                    opts.pop(0)
+                    opts.pop(0)
+
+                elif opts[0] == 'holdtime':
+                    if F_NO in flags:
+                        txn.map_delete_key('System', 'other_config',
+                                           'lldp_hold')
+                    else:
+                        txn.map_set_key('System', 'other_config', 'lldp_hold',
+                                        str(opts[1]))
+                    opts.pop(0)
+                    opts.pop(0)
+
+                elif opts[0] == 'timer':
+                    if F_NO in flags:
+                        txn.map_delete_key('System', 'other_config',
+                                           'lldp_tx_interval')
+                    else:
+                        txn.map_set_key('System', 'other_config',
+                                        'lldp_tx_interval', str(opts[1]))
+                    opts.pop(0)
+                    opts.pop(0)
+
+                elif opts[0] == 'select-tlv':
+                    for word, map_key, descr in tlv_keys:
+                        if opts[1] == word:
+                            key = map_key
+                            break
+                    value = str(F_NO not in flags).lower()
+                    txn.map_set_key('System', 'other_config', key, value)
+                    opts.pop(0)
+                    opts.pop(0)
+
+                elif opts[0] == 'clear':
+                    if opts[1] == 'counters':
+                        sem = 'lldp_num_clear_counters_requested'
+                    elif opts[1] == 'neighbors':
+                        sem = 'lldp_num_clear_table_requested'
+                    req = ovsdb.get_map('System', 'status')
+                    counter = int(req.get(sem, 0))
+                    counter += 1
+                    txn.map_set_key('System', 'status', sem, str(counter))
+                    opts.pop(0)
+                    opts.pop(0)
 
 register_commands((Conf_lldp,), tree='config')
 